@@ -1,6 +1,7 @@
 import logging
 
 import fastapi
+import fastapi.responses
 
 from . import handlers
 from . import user_api, scope_api, oauth_api
@@ -9,7 +10,8 @@ _logger = logging.getLogger(__name__)
 """The logger for all API activity"""
 
 # %% API Setup
-service = fastapi.FastAPI()
+service = fastapi.FastAPI(default_response_class=fastapi.responses.ORJSONResponse)
+handlers.configure(service)
 
 
 # %% API Endpoints
@@ -1,11 +1,15 @@
 """Package containing some custom dependencies for the API application"""
-import datetime
+import hashlib
 import http
+import threading
+import time
+import typing
+import urllib.parse
 
+import cachetools
 import fastapi.security
-import pytz.reference
-from pydantic import SecretStr
 
+import api.utilities
 import database.crud
 import exceptions
 import models.common
@@ -14,6 +18,122 @@ __oauth2_scheme = fastapi.security.OAuth2PasswordBearer(
     tokenUrl="oauth/token", scheme_name="WISdoM Central Authorization", auto_error=False
 )
 
+__token_cache = cachetools.TTLCache(maxsize=10000, ttl=30)
+"""
+Short living cache for resolved access tokens
+
+The entries are keyed by the hashed access token and contain the token information, the owner of the token, the
+scopes of the token and the bitmask of these scopes. The short TTL limits how long changes to an account may go
+unnoticed
+"""
+
+__token_cache_lock = threading.Lock()
+"""Lock guarding the token cache since the dependency is executed in a threadpool"""
+
+
+# %% Static Errors
+_missing_credentials_error = exceptions.APIException(
+    error_code="INVALID_REQUEST",
+    error_name="Invalid Request",
+    error_description="The request did not contain the necessary credentials to allow processing this request",
+    status_code=http.HTTPStatus.BAD_REQUEST,
+)
+
+_invalid_token_error = exceptions.APIException(
+    error_code="INVALID_TOKEN",
+    error_name="Invalid Bearer Token",
+    error_description="The request did not contain the correct credentials to allow processing this request",
+    status_code=http.HTTPStatus.UNAUTHORIZED,
+)
+
+_expired_token_error = exceptions.APIException(
+    error_code="EXPIRED_TOKEN",
+    error_name="Expired Bearer Token",
+    error_description="The request did not contain a alive Bearer token",
+    status_code=http.HTTPStatus.UNAUTHORIZED,
+)
+
+_token_before_creation_error = exceptions.APIException(
+    error_code="TOKEN_BEFORE_CREATION",
+    error_name="Credentials used too early",
+    error_description="The credentials used for this request are currently not valid",
+    status_code=http.HTTPStatus.UNAUTHORIZED,
+)
+
+_user_deleted_error = exceptions.APIException(
+    error_code="USER_DELETED",
+    error_name="User deleted",
+    error_description="The account used to access this resource was deleted",
+    status_code=http.HTTPStatus.UNAUTHORIZED,
+)
+
+_user_disabled_error = exceptions.APIException(
+    error_code="USER_DISABLED",
+    error_name="User Disabled",
+    error_description="The account used to access this resource is currently disabled",
+    status_code=http.HTTPStatus.FORBIDDEN,
+)
+
+_missing_privileges_error = exceptions.APIException(
+    error_code="MISSING_PRIVILEGES",
+    error_name="Missing Privileges",
+    error_description="The account used to access this resource does not have the privileges to access this endpoint",
+    status_code=http.HTTPStatus.FORBIDDEN,
+)
+
+_invalid_arguments_for_grant_type_error = exceptions.APIException(
+    error_code="INVALID_ARGUMENTS_FOR_GRANT_TYPE",
+    error_name="Invalid Arguments for specified grant type",
+    error_description="The form did not contain the necessary arguments for the specified grant type or arguments "
+    "from other grant types have been sent",
+    status_code=http.HTTPStatus.BAD_REQUEST,
+)
+
+_invalid_form_error = exceptions.APIException(
+    error_code="INVALID_REQUEST",
+    error_name="Invalid Request",
+    error_description="The request did not contain a valid form",
+    status_code=http.HTTPStatus.BAD_REQUEST,
+)
+
+_scope_not_found_error = exceptions.APIException(
+    error_code="SCOPE_NOT_FOUND",
+    error_name="Scope unavailable",
+    error_description="The scope you tried to access does not exist in the system",
+    status_code=http.HTTPStatus.NOT_FOUND,
+)
+
+_user_not_found_error = exceptions.APIException(
+    error_code="USER_NOT_FOUND",
+    error_name="User unavailable",
+    error_description="The user you tried to access does not exist in the system",
+    status_code=http.HTTPStatus.NOT_FOUND,
+)
+
+
+def forget_access_token(access_token: str) -> None:
+    """
+    Remove the supplied access token from the token cache
+
+    :param access_token: The clear-text access token
+    :type access_token: str
+    """
+    with __token_cache_lock:
+        __token_cache.pop(hashlib.sha3_224(access_token.encode("utf-8")).hexdigest(), None)
+
+
+def forget_user_tokens(identifier: typing.Union[str, int]) -> None:
+    """
+    Remove all access tokens of the supplied user from the token cache
+
+    :param identifier: The username or the internal id of the user account
+    :type identifier: typing.Union[str, int]
+    """
+    with __token_cache_lock:
+        for token_hash, (_, user, _, _) in list(__token_cache.items()):
+            if identifier in (user.id, user.username):
+                __token_cache.pop(token_hash, None)
+
 
 def get_authorized_user(
     scopes: fastapi.security.SecurityScopes,
@@ -31,63 +151,45 @@ def get_authorized_user(
     """
     # Check if any token has been set
     if access_token in (None, "undefined"):
-        raise exceptions.APIException(
-            error_code="INVALID_REQUEST",
-            error_name="Invalid Request",
-            error_description="The request did not contain the necessary credentials to allow processing this request",
-            status_code=http.HTTPStatus.BAD_REQUEST,
-        )
-    # Now get some data about the access token
-    token_information = database.crud.get_access_token_data(access_token)
-    if token_information is None:
-        raise exceptions.APIException(
-            error_code="INVALID_TOKEN",
-            error_name="Invalid Bearer Token",
-            error_description="The request did not contain the correct credentials to allow processing this request",
-            status_code=http.HTTPStatus.UNAUTHORIZED,
-        )
-    if datetime.datetime.now(tz=pytz.reference.LocalTimezone()) > token_information.expires:
-        raise exceptions.APIException(
-            error_code="EXPIRED_TOKEN",
-            error_name="Expired Bearer Token",
-            error_description="The request did not contain a alive Bearer token",
-            status_code=http.HTTPStatus.UNAUTHORIZED,
-        )
-    if datetime.datetime.now(tz=pytz.reference.LocalTimezone()) < token_information.created:
-        raise exceptions.APIException(
-            error_code="TOKEN_BEFORE_CREATION",
-            error_name="Credentials used too early",
-            error_description="The credentials used for this request are currently not valid",
-            status_code=http.HTTPStatus.UNAUTHORIZED,
-        )
-    # Get the information about the user account
-    user = database.crud.get_user_account(token_information.owner_id)
+        raise _missing_credentials_error.with_traceback(None)
+    token_hash = hashlib.sha3_224(access_token.encode("utf-8")).hexdigest()
+    with __token_cache_lock:
+        cached_token = __token_cache.get(token_hash)
+    if cached_token is not None:
+        token_information, user, available_scopes, available_scope_mask = cached_token
+    else:
+        # Get the access token, its owner and its scopes in a single query
+        token_context = database.crud.get_access_token_context(access_token)
+        if token_context is None:
+            raise _invalid_token_error.with_traceback(None)
+        token_information, user, available_scopes = token_context
+    now = time.time()
+    if now > token_information.expires.timestamp():
+        raise _expired_token_error.with_traceback(None)
+    if now < token_information.created.timestamp():
+        raise _token_before_creation_error.with_traceback(None)
     if user is None:
-        raise exceptions.APIException(
-            error_code="USER_DELETED",
-            error_name="User deleted",
-            error_description="The account used to access this resource was deleted",
-            status_code=http.HTTPStatus.UNAUTHORIZED,
-        )
+        raise _user_deleted_error.with_traceback(None)
+    if cached_token is None:
+        # The scope set and its bitmask are computed once per cached token instead of on every request
+        available_scopes = frozenset(available_scopes)
+        available_scope_mask = api.utilities.scope_mask(available_scopes)
+        with __token_cache_lock:
+            __token_cache[token_hash] = (token_information, user, available_scopes, available_scope_mask)
     if not user.active:
-        raise exceptions.APIException(
-            error_code="USER_DISABLED",
-            error_name="User Disabled",
-            error_description="The account used to access this resource is currently disabled",
-            status_code=http.HTTPStatus.FORBIDDEN,
-        )
-    # Now get the users scopes
-    access_token_scopes = database.crud.get_access_token_scopes(token_information)
-    required_scopes = set(sorted(scopes.scopes))
-    available_scopes = set(sorted([scope.scope_string_value for scope in access_token_scopes]))
-    if not required_scopes.issubset(available_scopes):
-        raise exceptions.APIException(
-            error_code="MISSING_PRIVILEGES",
-            error_name="Missing Privileges",
-            error_description="The account used to access this resource does not have the privileges to access this "
-            "endpoint",
-            status_code=http.HTTPStatus.FORBIDDEN,
-        )
+        raise _user_disabled_error.with_traceback(None)
+    if not scopes.scopes:
+        # Endpoints without required scopes only need an authorized user
+        return user
+    required_scopes = tuple(scopes.scopes)
+    required_mask = api.utilities.required_scope_mask(required_scopes)
+    if required_mask is not None:
+        # All required scopes have an assigned bit, therefore a single mask comparison is sufficient
+        has_required_scopes = (available_scope_mask & required_mask) == required_mask
+    else:
+        has_required_scopes = api.utilities.required_scope_set(required_scopes) <= available_scopes
+    if not has_required_scopes:
+        raise _missing_privileges_error.with_traceback(None)
     return user
 
 
@@ -112,9 +214,9 @@ class OAuth2AuthorizationRequestForm:
 
     def __init__(
         self,
-        grant_type: str = fastapi.Form(None, regex="(?:^password$|^refresh_token$)"),
+        grant_type: str = fastapi.Form(None),
         username: str = fastapi.Form(None, min_length=1),
-        password: SecretStr = fastapi.Form(None, min_length=1),
+        password: str = fastapi.Form(None, min_length=1),
         refresh_token: str = fastapi.Form(None, min_length=1),
         scope: str = fastapi.Form(""),
     ):
@@ -125,14 +227,15 @@ class OAuth2AuthorizationRequestForm:
         Using "password" as grant_type -> "refresh_token"
         Using "refresh_token" as grant_type -> "username", "password"
 
-        The refresh tokens format is automatically validated using a regex.
+        Unsupported grant types are not rejected by the form itself, since the token endpoint already answers them
+        with an UNSUPPORTED_GRANT_TYPE error.
 
         :param grant_type: Grant type (supported values: "password", "refresh_token")
         :type grant_type: str
         :param username: Username of the account
         :type username: str
         :param password: Password of the account
-        :type password: SecretStr
+        :type password: str
         :param refresh_token: Refresh token issued by a different request
         :type refresh_token: str
         :param scope: Scope string
@@ -144,26 +247,104 @@ class OAuth2AuthorizationRequestForm:
         if self.grant_type == "password":
             # Check if the username and password are present in the request
             if None in (username, password) or refresh_token is not None:
-                raise exceptions.APIException(
-                    error_code="INVALID_ARGUMENTS_FOR_GRANT_TYPE",
-                    error_name="Invalid Arguments for specified grant type",
-                    error_description="The form did not contain the necessary arguments for the specified grant type "
-                    "or arguments from other grant types have been sent",
-                    status_code=http.HTTPStatus.BAD_REQUEST,
-                )
+                raise _invalid_arguments_for_grant_type_error.with_traceback(None)
             # Save the username and password after passing this check
             self.username = username.strip()
             self.password = password
         if self.grant_type == "refresh_token":
             if refresh_token is None or None not in (username, password):
-                raise exceptions.APIException(
-                    error_code="INVALID_ARGUMENTS_FOR_GRANT_TYPE",
-                    error_name="Invalid Arguments for specified grant type",
-                    error_description="The form did not contain the necessary arguments for the specified grant type "
-                    "or arguments from other grant types have been sent",
-                    status_code=http.HTTPStatus.BAD_REQUEST,
-                )
+                raise _invalid_arguments_for_grant_type_error.with_traceback(None)
             # Save the refresh token after passing this check
             self.refresh_token = refresh_token.strip()
         # Save the scopes to the form
         self.scopes = scope.strip()
+        # Split the scopes once, since the handlers only need the distinct scope values
+        self.scope_set = frozenset(self.scopes.split())
+
+
+async def get_token_request_form(request: fastapi.Request) -> OAuth2AuthorizationRequestForm:
+    """
+    Build the OAuth2AuthorizationRequestForm from the body of a token request
+
+    Token requests are small url-encoded forms. These are parsed directly instead of passing every field through the
+    form parsing and validation of FastAPI. Other content types are parsed using the form parser of Starlette
+
+    :param request: The token request
+    :type request: fastapi.Request
+    :return: The form containing the information of the token request
+    :rtype: OAuth2AuthorizationRequestForm
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+            body = await request.body()
+            fields = {
+                key: values[0] for key, values in urllib.parse.parse_qs(body.decode("utf-8"), max_num_fields=8).items()
+            }
+        else:
+            fields = {key: value for key, value in (await request.form()).items() if type(value) is str and value}
+    except ValueError:
+        fields = None
+    # The error is raised outside the except block, since raising it inside would attach the current ValueError as
+    # context to the shared error instance and keep it alive until the next raise
+    if fields is None:
+        raise _invalid_form_error.with_traceback(None)
+    return OAuth2AuthorizationRequestForm(
+        grant_type=fields.get("grant_type"),
+        username=fields.get("username"),
+        password=fields.get("password"),
+        refresh_token=fields.get("refresh_token"),
+        scope=fields.get("scope", ""),
+    )
+
+
+def get_scope_or_404(scope_identifier: typing.Union[str, int]) -> models.common.Scope:
+    """
+    Get the scope addressed in the path of the request
+
+    :param scope_identifier: The scope string value or the internal id of the scope
+    :type scope_identifier: typing.Union[str, int]
+    :return: The requested scope
+    :rtype: models.common.Scope
+    :raises exceptions.APIException: The scope does not exist
+    """
+    requested_scope = database.crud.get_scope(scope_identifier)
+    if requested_scope is None:
+        raise _scope_not_found_error.with_traceback(None)
+    return requested_scope
+
+
+def get_stored_scope_or_404(scope_identifier: typing.Union[str, int]) -> models.common.Scope:
+    """
+    Get the scope addressed in the path of the request directly from the database
+
+    The cached scopes may not reflect changes made by other workers. Therefore, this dependency is used by endpoints
+    changing the scope
+
+    :param scope_identifier: The scope string value or the internal id of the scope
+    :type scope_identifier: typing.Union[str, int]
+    :return: The requested scope
+    :rtype: models.common.Scope
+    :raises exceptions.APIException: The scope does not exist
+    """
+    requested_scope = database.crud.get_scope(scope_identifier, use_cache=False)
+    if requested_scope is None:
+        raise _scope_not_found_error.with_traceback(None)
+    return requested_scope
+
+
+def get_user_or_404(
+    account_identification: typing.Union[str, int]
+) -> tuple[models.common.UserAccount, list[models.common.Scope]]:
+    """
+    Get the user account addressed in the path of the request together with its scopes
+
+    :param account_identification: The username or the internal id of the account
+    :type account_identification: typing.Union[str, int]
+    :return: The requested account and its scopes
+    :rtype: tuple[models.common.UserAccount, list[models.common.Scope]]
+    :raises exceptions.APIException: The account does not exist
+    """
+    requested_user_information = database.crud.get_user_account_with_scopes(account_identification)
+    if requested_user_information is None:
+        raise _user_not_found_error.with_traceback(None)
+    return requested_user_information
@@ -1,5 +1,6 @@
 import http
 
+import orjson
 import sqlalchemy.exc
 
 import exceptions
@@ -8,10 +9,36 @@ import configuration
 
 import database.tables
 
+_service_name = configuration.get_service_configuration().name
+"""The name of the service used as prefix for the error codes"""
+
+
+_startup_complete = False
+"""Indicator if the startup tasks already ran in this process"""
+
+
+def configure(app: fastapi.FastAPI) -> None:
+    """
+    Register the exception handlers and the startup handler on the supplied application
+
+    Mounted applications handle their own exceptions, therefore every application needs the exception handlers
+
+    :param app: The application which shall be configured
+    :type app: fastapi.FastAPI
+    """
+    app.add_exception_handler(exceptions.APIException, handle_api_error)
+    app.add_exception_handler(sqlalchemy.exc.IntegrityError, handle_integrity_error)
+    app.add_exception_handler(fastapi.exceptions.RequestValidationError, handle_request_validation_error)
+    app.add_event_handler("startup", api_startup)
+
 
 # %% Event Handlers
 def api_startup():
+    global _startup_complete
+    if _startup_complete:
+        return
     database.tables.initialize()
+    _startup_complete = True
 
 
 # %% Exception Handlers
@@ -19,33 +46,64 @@ async def handle_api_error(_: fastapi.requests.Request, exception: exceptions.AP
     content = {
         "httpCode": exception.http_code.value,
         "httpError": exception.http_code.phrase,
-        "error": configuration.ServiceConfiguration().name + f".{exception.error_code}",
-        "errorName": exception.error_name,
-        "errorDescription": exception.error_description,
+        "error": f"{_service_name}.{exception.error_code}",
     }
-    for key, value in content.items():
-        if value is None:
-            content.pop(key)
+    if exception.error_name is not None:
+        content["errorName"] = exception.error_name
+    if exception.error_description is not None:
+        content["errorDescription"] = exception.error_description
     return fastapi.responses.ORJSONResponse(status_code=exception.http_code.value, content=content)
 
 
-async def handle_integrity_error(_: fastapi.requests.Request, _exception: sqlalchemy.exc.IntegrityError):
-    content = {
+_integrity_error_body = orjson.dumps(
+    {
         "httpCode": http.HTTPStatus.CONFLICT.value,
         "httpError": http.HTTPStatus.CONFLICT.phrase,
-        "error": configuration.ServiceConfiguration().name + f".DUPLICATE_ENTRY",
+        "error": f"{_service_name}.DUPLICATE_ENTRY",
         "errorName": "Constraint Violation",
         "errorDescription": "The resource you are trying to create already exists",
     }
-    return fastapi.responses.ORJSONResponse(content=content, status_code=http.HTTPStatus.CONFLICT)
+)
+"""The pre-serialized response body for integrity errors"""
 
+_missing_reference_error_body = orjson.dumps(
+    {
+        "httpCode": http.HTTPStatus.NOT_FOUND.value,
+        "httpError": http.HTTPStatus.NOT_FOUND.phrase,
+        "error": f"{_service_name}.REFERENCED_ENTRY_NOT_FOUND",
+        "errorName": "Referenced Resource Unavailable",
+        "errorDescription": "A resource referenced by your request does not exist (anymore)",
+    }
+)
+"""The pre-serialized response body for integrity errors caused by references to deleted entries"""
 
-def handle_request_validation_error(_: fastapi.requests.Request, _exception: fastapi.exceptions.RequestValidationError):
-    content = {
+_FOREIGN_KEY_VIOLATION = "23503"
+"""The PostgreSQL error code raised if a referenced row does not exist"""
+
+_request_validation_error_body = orjson.dumps(
+    {
         "httpCode": http.HTTPStatus.BAD_REQUEST.value,
         "httpError": http.HTTPStatus.BAD_REQUEST.phrase,
-        "error": configuration.ServiceConfiguration().name + f".BAD_REQUEST",
+        "error": f"{_service_name}.BAD_REQUEST",
         "errorName": "Bad Request Parameters",
         "errorDescription": "The request did not contain all necessary parameters to be executed successfully",
     }
-    return fastapi.responses.ORJSONResponse(content=content, status_code=http.HTTPStatus.BAD_REQUEST)
+)
+"""The pre-serialized response body for request validation errors"""
+
+
+async def handle_integrity_error(_: fastapi.requests.Request, exception: sqlalchemy.exc.IntegrityError):
+    # Scopes taken from the scope cache of a worker may have been deleted by another worker in the meantime
+    if getattr(exception.orig, "pgcode", None) == _FOREIGN_KEY_VIOLATION:
+        return fastapi.Response(
+            content=_missing_reference_error_body, media_type="application/json", status_code=http.HTTPStatus.NOT_FOUND
+        )
+    return fastapi.Response(
+        content=_integrity_error_body, media_type="application/json", status_code=http.HTTPStatus.CONFLICT
+    )
+
+
+def handle_request_validation_error(_: fastapi.requests.Request, _exception: fastapi.exceptions.RequestValidationError):
+    return fastapi.Response(
+        content=_request_validation_error_body, media_type="application/json", status_code=http.HTTPStatus.BAD_REQUEST
+    )
@@ -2,76 +2,68 @@ import typing
 from http import HTTPStatus
 
 import fastapi.requests
-import sqlalchemy.exc
+import fastapi.responses
 
 import api.dependencies
+import api.utilities
 import database.crud
 import exceptions
 import models.common
 import models.requests
 
 # %% API Setup
-scope_api = fastapi.FastAPI()
-scope_api.add_exception_handler(exceptions.APIException, api.handlers.handle_api_error)
-scope_api.add_exception_handler(sqlalchemy.exc.IntegrityError, api.handlers.handle_integrity_error)
-scope_api.add_exception_handler(fastapi.exceptions.RequestValidationError, api.handlers.handle_request_validation_error)
-scope_api.add_event_handler("startup", api.handlers.api_startup)
+scope_api = fastapi.FastAPI(default_response_class=fastapi.responses.ORJSONResponse)
+api.handlers.configure(scope_api)
+
+RESERVED_SCOPES = frozenset({"administration", "account"})
+"""The scopes required by the authorization service itself which may not be modified or deleted"""
 
 
 # %% Routes
 @scope_api.get("/{scope_identifier}")
-async def get_scope_information(
-    scope_identifier: typing.Union[str, int],
+def get_scope_information(
+    request: fastapi.Request,
     user: models.common.UserAccount = fastapi.Security(api.dependencies.get_authorized_user, scopes=["administrator"]),
+    requested_scope: models.common.Scope = fastapi.Depends(api.dependencies.get_scope_or_404),
 ):
-    requested_scope = database.crud.get_scope(scope_identifier)
-    if requested_scope is None:
-        raise exceptions.APIException(
-            error_code="SCOPE_NOT_FOUND",
-            error_name="Scope unavailable",
-            error_description="The scope you tried to access does not exist in the system",
-            status_code=HTTPStatus.NOT_FOUND,
-        )
-    return requested_scope
+    return api.utilities.conditional_response(request, requested_scope)
 
 
 @scope_api.patch(path="/{scope_identifier}")
-async def update_scope_information(
-    scope_identifier: typing.Union[str, int],
+def update_scope_information(
     user: models.common.UserAccount = fastapi.Security(api.dependencies.get_authorized_user, scopes=["administrator"]),
+    requested_scope: models.common.Scope = fastapi.Depends(api.dependencies.get_stored_scope_or_404),
     scope_update_data: models.requests.ScopeUpdateData = fastapi.Body(...),
 ):
-    if scope_identifier in ["administration", "account"]:
+    if requested_scope.scope_string_value in RESERVED_SCOPES:
         raise exceptions.APIException(
             error_code="SCOPE_DEADLOCK",
             error_name="Scope Deadlock Prevented",
-            error_description=f"The '{scope_identifier}' scope may not be edited, since this will result in a "
-            f"deadlocked system since the authorization service requires this scope",
+            error_description=f"The '{requested_scope.scope_string_value}' scope may not be edited, since this will "
+            f"result in a deadlocked system since the authorization service requires this scope",
             status_code=HTTPStatus.FORBIDDEN,
         )
-    requested_scope = database.crud.get_scope(scope_identifier)
-    if requested_scope is None:
+    # Only update the columns for which a new value has been sent
+    scope_patch = scope_update_data.dict(exclude_none=True)
+    if len(scope_patch) == 0:
+        return requested_scope
+    updated_scope = database.crud.patch_scope(requested_scope.id, scope_patch)
+    if updated_scope is None:
         raise exceptions.APIException(
             error_code="SCOPE_NOT_FOUND",
             error_name="Scope unavailable",
             error_description="The scope you tried to access does not exist in the system",
             status_code=HTTPStatus.NOT_FOUND,
         )
-    requested_scope.name = scope_update_data.name if scope_update_data.name is not None else requested_scope.name
-    requested_scope.description = (
-        scope_update_data.description if scope_update_data.name is not None else requested_scope.description
-    )
-    database.crud.store_changed_scope(requested_scope)
-    # Get the updated scope data
-    return database.crud.get_scope(requested_scope.id)
+    return updated_scope
 
 
 @scope_api.delete(path="/{scope_identifier}")
-async def delete_scope(
+def delete_scope(
     scope_identifier: typing.Union[str, int],
     user: models.common.UserAccount = fastapi.Security(api.dependencies.get_authorized_user, scopes=["administrator"]),
 ):
-    if scope_identifier in ["administration", "account"]:
+    if isinstance(scope_identifier, str) and scope_identifier in RESERVED_SCOPES:
         raise exceptions.APIException(
             error_code="SCOPE_DEADLOCK",
             error_name="Scope Deadlock Prevented",
@@ -79,42 +71,39 @@ async def delete_scope(
             f"out everyone from the authorization service",
             status_code=HTTPStatus.FORBIDDEN,
         )
-    requested_scope = database.crud.get_scope(scope_identifier)
-    if requested_scope is None:
+    if not database.crud.delete_scope(scope_identifier):
         raise exceptions.APIException(
             error_code="SCOPE_NOT_FOUND",
             error_name="Scope unavailable",
             error_description="The scope you tried to access does not exist in the system",
             status_code=HTTPStatus.NOT_FOUND,
         )
-    database.crud.delete_scope(requested_scope)
     return fastapi.Response(status_code=HTTPStatus.NO_CONTENT)
 
 
 @scope_api.put(path="/new")
-async def new_scope(
+def new_scope(
     user: models.common.UserAccount = fastapi.Security(api.dependencies.get_authorized_user, scopes=["administrator"]),
     new_scope_data: models.requests.ScopeCreationData = fastapi.Body(...),
 ):
-    database.crud.store_new_scope(new_scope_data)
-    scope = database.crud.get_scope(new_scope_data.scope_string_value)
-    return scope
+    return database.crud.store_new_scope(new_scope_data)
 
 
 @scope_api.put(path="/__new")
-async def new_scope(
+def new_scope(
     new_scope_data: models.requests.ScopeCreationData = fastapi.Body(...),
 ):
-    s = database.crud.get_scope(new_scope_data.scope_string_value)
-    if s is None:
-        database.crud.store_new_scope(new_scope_data)
-
     scope = database.crud.get_scope(new_scope_data.scope_string_value)
+    if scope is None:
+        scope = database.crud.store_new_scope(new_scope_data)
     return scope
 
 
 @scope_api.get(path="/")
-async def get_scopes(
+def get_scopes(
+    request: fastapi.Request,
     user: models.common.UserAccount = fastapi.Security(api.dependencies.get_authorized_user, scopes=["administrator"]),
 ):
-    return database.crud.get_scopes()
+    if api.utilities.accepts_ndjson(request):
+        return api.utilities.ndjson_response(database.crud.stream_scopes())
+    return api.utilities.conditional_response(request, database.crud.get_scopes())
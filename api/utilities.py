@@ -1,9 +1,163 @@
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import hashlib
+import os
+import threading
 import typing
+from http import HTTPStatus
 
-import passlib.hash
+import fastapi
+import fastapi.encoders
+import fastapi.responses
+import orjson
+import pydantic
 
+import configuration
 import database.crud
 import models.common
+import tools
+
+password_pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+"""
+Process pool used for hashing and verifying passwords
+
+Argon2 is CPU-bound by design. Running it in a separate process pool keeps the event loop free and lets a single
+worker use all available cores for password checks, at the cost of pickling the password and hash to the pool
+processes. Deployments running multiple workers per container may prefer scaling the workers instead.
+"""
+
+_password_pool_lock = threading.Lock()
+"""Lock preventing multiple threads from replacing a broken password pool at the same time"""
+
+
+def run_in_password_pool(function: typing.Callable[..., typing.Any], *args: typing.Any) -> typing.Any:
+    """
+    Execute the function in the password pool and wait for its result
+
+    If a process of the pool died (e.g. since it has been killed by the OOM killer), the pool is unusable. In this case
+    the pool is replaced by a new one and the function is executed once more
+
+    :param function: The function which shall be executed in the pool
+    :type function: typing.Callable[..., typing.Any]
+    :param args: The arguments for the function
+    :type args: typing.Any
+    :return: The result of the function
+    :rtype: typing.Any
+    """
+    global password_pool
+    pool = password_pool
+    try:
+        return pool.submit(function, *args).result()
+    except concurrent.futures.process.BrokenProcessPool:
+        with _password_pool_lock:
+            # Another thread may have replaced the broken pool already
+            if password_pool is pool:
+                password_pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+                pool.shutdown(wait=False)
+            pool = password_pool
+        return pool.submit(function, *args).result()
+
+
+SCOPE_BITS: dict[str, int] = {
+    scope.scope_string_value: 1 << index for index, scope in enumerate(configuration.get_required_scopes())
+}
+"""Bit assigned to each scope which is required by the service itself"""
+
+
+def scope_mask(scopes: typing.Iterable[str]) -> int:
+    """
+    Build the bit mask for the supplied scopes. Scopes without an assigned bit are ignored
+
+    :param scopes: The scope string values
+    :type scopes: typing.Iterable[str]
+    :return: The bit mask of the scopes
+    :rtype: int
+    """
+    mask = 0
+    for scope in scopes:
+        mask |= SCOPE_BITS.get(scope, 0)
+    return mask
+
+
+@functools.lru_cache(maxsize=None)
+def required_scope_mask(scopes: tuple[str, ...]) -> typing.Optional[int]:
+    """
+    Build the bit mask for the scopes required by an endpoint
+
+    :param scopes: The scope string values required by the endpoint
+    :type scopes: tuple[str, ...]
+    :return: The bit mask of the scopes or None if a scope has no assigned bit
+    :rtype: typing.Optional[int]
+    """
+    if not all(scope in SCOPE_BITS for scope in scopes):
+        return None
+    return scope_mask(scopes)
+
+
+@functools.lru_cache(maxsize=None)
+def required_scope_set(scopes: tuple[str, ...]) -> frozenset[str]:
+    """
+    Get the scopes required by an endpoint as frozenset
+
+    :param scopes: The scope string values required by the endpoint
+    :type scopes: tuple[str, ...]
+    :return: The required scopes
+    :rtype: frozenset[str]
+    """
+    return frozenset(scopes)
+
+
+def conditional_response(request: fastapi.Request, content: typing.Any) -> fastapi.Response:
+    """
+    Serialize the content and tag it with a weak ETag derived from the serialized body
+
+    If the client already holds the current representation (indicated by the ``If-None-Match`` header) an empty
+    response with the status code 304 is returned instead of the body
+
+    :param request: The request which is answered
+    :type request: fastapi.Request
+    :param content: The content of the response
+    :type content: typing.Any
+    :return: The response with the ETag header set
+    :rtype: fastapi.Response
+    """
+    body = orjson.dumps(fastapi.encoders.jsonable_encoder(content))
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    known_tags = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in known_tags or "*" in known_tags:
+        return fastapi.Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
+    return fastapi.Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+"""Media type of newline delimited JSON which may be requested by clients listing large collections"""
+
+
+def accepts_ndjson(request: fastapi.Request) -> bool:
+    """
+    Check if the client requested the response as newline delimited JSON
+
+    :param request: The request which is answered
+    :type request: fastapi.Request
+    :return: True if the ``Accept`` header contains the NDJSON media type
+    :rtype: bool
+    """
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(items: typing.Iterable[pydantic.BaseModel]) -> fastapi.responses.StreamingResponse:
+    """
+    Stream the items as newline delimited JSON, serializing every item when it is sent
+
+    :param items: The items which shall be streamed
+    :type items: typing.Iterable[pydantic.BaseModel]
+    :return: The streaming response
+    :rtype: fastapi.responses.StreamingResponse
+    """
+    return fastapi.responses.StreamingResponse(
+        (orjson.dumps(item.dict(by_alias=True)) + b"\n" for item in items), media_type=NDJSON_MEDIA_TYPE
+    )
 
 
 def hash_password(password: str) -> str:
@@ -14,7 +168,11 @@ def hash_password(password: str) -> str:
     :return: The hashed password
     :rtype: str
     """
-    return passlib.hash.argon2.using(type="ID").hash(password)
+    return tools.password_hasher.hash(password)
+
+
+DUMMY_PASSWORD_HASH = hash_password("")
+"""Hash which is verified for unknown users to prevent distinguishing them by the response time"""
 
 
 def verify_password(password: str, hash: str) -> bool:
@@ -28,26 +186,50 @@ def verify_password(password: str, hash: str) -> bool:
     :return: True if the password and the hash matches
     :rtype: bool
     """
-    return passlib.hash.argon2.verify(password, hash)
+    return tools.password_hasher.verify(password, hash)
 
 
 def generate_token_set(
-    user: models.common.UserAccount, scopes: typing.Union[list[str], str]
+    user: models.common.UserAccount,
+    scopes: typing.Union[typing.Collection[str], str],
+    default_to_user_scopes: bool = False,
 ) -> models.common.TokenSet:
     """
     Generate a new token set and insert it into the database
 
     :param user: The user for which the token set shall be generated
     :type user: models.common.UserAccount
-    :param scopes: A list of the scopes the token shall get
-    :type scopes: list[str]
+    :param scopes: The scopes the token shall get, either as collection or as space separated string
+    :type scopes: typing.Union[typing.Collection[str], str]
+    :param default_to_user_scopes: Issue the token for all scopes of the user if no scopes have been supplied. Only
+        the password grant may use this, since a refresh must never widen the scopes of a token
+    :type default_to_user_scopes: bool
     :return: The generated token set
     :rtype: models.common.TokenSet
     """
-    # Check if any scopes have been supplied. If not pull all scopes from the database
-    if type(scopes) is str and scopes.strip() == "":
-        scopes = " ".join(
-            [scope.scope_string_value for scope in database.crud.get_user_scopes(user)]
-        )
-    token_set = models.common.TokenSet(scopes=scopes)
+    if type(scopes) is str:
+        scopes = scopes.split()
+    # Check if any scopes have been requested. If not and allowed, pull all scopes of the user from the database
+    if len(scopes) == 0 and default_to_user_scopes:
+        scopes = [scope.scope_string_value for scope in database.crud.get_user_scopes(user)]
+    token_set = models.common.TokenSet(scopes=" ".join(sorted(scopes)))
     return token_set
+
+
+def store_token_set(user: models.common.UserAccount, token_set: models.common.TokenSet) -> None:
+    """
+    Store a newly issued token set in the database and in the api gateway
+
+    If the token set could not be stored in the gateway it is removed from the database again to keep both in sync
+
+    :param user: The user to which the token set has been issued
+    :type user: models.common.UserAccount
+    :param token_set: The issued token set
+    :type token_set: models.common.TokenSet
+    """
+    database.crud.insert_token_set(user=user, token_set=token_set)
+    try:
+        tools.store_token_in_gateway(token_set=token_set, username=user.username)
+    except Exception:
+        database.crud.delete_token_set(token_set)
+        raise
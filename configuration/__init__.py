@@ -1,7 +1,13 @@
 """Module containing all configuration which are used in the application"""
+import functools
+import pathlib
+
+import orjson
 import pydantic
 from pydantic import BaseSettings, AmqpDsn, stricturl, Field
 
+import models.requests
+
 
 class ServiceConfiguration(BaseSettings):
     """Settings related to the general service execution"""
@@ -46,6 +52,20 @@ class ServiceConfiguration(BaseSettings):
     The level of logging which will be used by the root logger
     """
 
+    workers: int = Field(
+        default=1,
+        title="Worker Processes",
+        description="The number of worker processes handling the requests",
+        env="CONFIG_SERVICE_WORKERS",
+    )
+    """
+    Worker Processes
+
+    The number of worker processes which handle the requests. Every worker keeps its own token cache
+    and password hashing pool, so revoked tokens may be accepted by other workers until their cache
+    entry expires
+    """
+
     class Config:
         """Configuration of the service configuration"""
 
@@ -69,6 +89,57 @@ class DatabaseConfiguration(BaseSettings):
     this service
     """
 
+    pool_size: int = Field(
+        default=10,
+        title="Connection Pool Size",
+        description="The number of connections which are kept open in the connection pool",
+        env="CONFIG_DB_POOL_SIZE",
+    )
+    """
+    Connection Pool Size
+
+    The number of connections to the database which are kept open in the connection pool
+    """
+
+    max_overflow: int = Field(
+        default=5,
+        title="Connection Pool Overflow",
+        description="The number of connections which may be opened additionally to the pool size",
+        env="CONFIG_DB_MAX_OVERFLOW",
+    )
+    """
+    Connection Pool Overflow
+
+    The number of connections which may be opened in addition to the connections in the pool
+    if all pooled connections are in use
+    """
+
+    pool_recycle: int = Field(
+        default=1800,
+        title="Connection Recycle Time",
+        description="The number of seconds after which a pooled connection is replaced",
+        env="CONFIG_DB_POOL_RECYCLE",
+    )
+    """
+    Connection Recycle Time
+
+    The number of seconds after which a connection in the pool is replaced by a new connection
+    """
+
+    pool_pre_ping: bool = Field(
+        default=True,
+        title="Connection Pre-Ping",
+        description="Indicator if a pooled connection is tested before it is used",
+        env="CONFIG_DB_POOL_PRE_PING",
+    )
+    """
+    Connection Pre-Ping
+
+    Indicator if a connection from the pool is tested before it is used. This costs an additional
+    round-trip for every checkout, but transparently replaces connections which have been closed by
+    the database server
+    """
+
     class Config:
         """Configuration of the AMQP related configuration"""
 
@@ -89,3 +160,86 @@ class KongGatewayInformation(pydantic.BaseSettings):
 
     class Config:
         env_file = ".env"
+
+
+class Argon2Configuration(BaseSettings):
+    """Settings related to the hashing of passwords using Argon2id"""
+
+    memory_cost: int = Field(
+        default=19456,
+        title="Argon2 Memory Cost",
+        description="The amount of memory in KiB used for hashing a password",
+        env="CONFIG_ARGON2_MEMORY_COST",
+    )
+    """
+    Argon2 Memory Cost
+
+    The amount of memory in KiB which is used for hashing a single password. The default follows
+    the OWASP recommendation
+    """
+
+    time_cost: int = Field(
+        default=2,
+        title="Argon2 Time Cost",
+        description="The number of iterations used for hashing a password",
+        env="CONFIG_ARGON2_TIME_COST",
+    )
+    """
+    Argon2 Time Cost
+
+    The number of iterations which are used for hashing a single password
+    """
+
+    parallelism: int = Field(
+        default=1,
+        title="Argon2 Parallelism",
+        description="The number of threads used for hashing a password",
+        env="CONFIG_ARGON2_PARALLELISM",
+    )
+    """
+    Argon2 Parallelism
+
+    The number of threads which are used for hashing a single password
+    """
+
+    class Config:
+        """Configuration of the Argon2 related configuration"""
+
+        env_file = ".env"
+        """The file from which the configuration may be read"""
+
+
+@functools.lru_cache(maxsize=1)
+def get_service_configuration() -> ServiceConfiguration:
+    """Get the service configuration which is read once per process"""
+    return ServiceConfiguration()
+
+
+@functools.lru_cache(maxsize=1)
+def get_database_configuration() -> DatabaseConfiguration:
+    """Get the database configuration which is read once per process"""
+    return DatabaseConfiguration()
+
+
+@functools.lru_cache(maxsize=1)
+def get_kong_gateway_information() -> KongGatewayInformation:
+    """Get the information about the api gateway which is read once per process"""
+    return KongGatewayInformation()
+
+
+@functools.lru_cache(maxsize=1)
+def get_argon2_configuration() -> Argon2Configuration:
+    """Get the Argon2 configuration which is read once per process"""
+    return Argon2Configuration()
+
+
+@functools.lru_cache(maxsize=1)
+def get_required_scopes() -> tuple[models.requests.ScopeCreationData, ...]:
+    """Get the scopes required by the service itself which are read from the scopes.json once per process"""
+    return tuple(
+        pydantic.parse_raw_as(
+            list[models.requests.ScopeCreationData],
+            (pathlib.Path(__file__).parent / "scopes.json").read_bytes(),
+            json_loads=orjson.loads,
+        )
+    )
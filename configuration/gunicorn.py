@@ -1,4 +1,6 @@
 import asyncio
+import concurrent.futures
+import functools
 import logging
 import pathlib
 import socket
@@ -14,14 +16,17 @@ import database.crud
 import database.helpers
 import database.tables
 import enums
-import models.requests
 import tools
 
-_service_settings = configuration.ServiceConfiguration()
+_service_settings = configuration.get_service_configuration()
+
+_KONG_CONFIGURED_FILE = pathlib.Path("/.kong_configured")
+"""Marker written after the service has been registered in the api gateway completely"""
+
 
 # %% Configuration Variables
 bind = f"0.0.0.0:{_service_settings.http_port}"
-workers = 1
+workers = _service_settings.workers
 limit_request_line = 0
 limit_request_fields = 0
 limit_request_field_size = 0
@@ -31,7 +36,42 @@ preload_app = False
 worker_class = "uvicorn.workers.UvicornWorker"
 
 
+class _PrettyJSON:
+    """Wrapper pretty-printing the JSON body of a response only if the log record containing it is emitted"""
+
+    __slots__ = ("_response",)
+
+    def __init__(self, response: requests.Response):
+        self._response = response
+
+    def __str__(self) -> str:
+        return orjson.dumps(orjson.loads(self._response.content), option=orjson.OPT_INDENT_2).decode("utf-8")
+
+
 # %% Events
+@functools.lru_cache(maxsize=1)
+def _container_ip_address() -> str:
+    """
+    Resolve the ip address of the service container once, since it does not change while the service is running
+
+    :return: The ip address of the service container
+    :rtype: str
+    """
+    return socket.gethostbyname(socket.gethostname())
+
+
+async def _check_hosts(*hosts: tuple[str, int]) -> list[bool]:
+    """
+    Check the availability of the hosts concurrently, so the check only takes as long as the slowest host
+
+    :param hosts: The hostnames and ports which shall be checked
+    :type hosts: tuple[str, int]
+    :return: The availability of the hosts in the order they were supplied
+    :rtype: list[bool]
+    """
+    return await asyncio.gather(*(tools.is_host_available(host=host, port=port, timeout=10) for host, port in hosts))
+
+
 def on_starting(server):
     logging.basicConfig(
         format="[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s",
@@ -41,61 +81,57 @@ def on_starting(server):
     )
     # Try to read the configuration for connecting to the database
     try:
-        _database_settings = configuration.DatabaseConfiguration()
+        _database_settings = configuration.get_database_configuration()
     except pydantic.ValidationError as e:
         logging.critical("Unable to read the configuration for connecting to the database", exc_info=e)
         sys.exit(1)
-    logging.info("Checking the connection to the database")
-    _database_settings.dsn.port = 5432 if _database_settings.dsn.port is None else int(_database_settings.dsn.port)
-    _database_available = asyncio.run(
-        tools.is_host_available(host=_database_settings.dsn.host, port=_database_settings.dsn.port, timeout=10)
-    )
-    if not _database_available:
-        logging.critical(
-            "The database is not available. Since this service requires an access to the database the service will "
-            "not start"
-        )
-        sys.exit(2)
     try:
-        _gateway_information = configuration.KongGatewayInformation()
+        _gateway_information = configuration.get_kong_gateway_information()
     except pydantic.ValidationError:
         logging.critical(
             "Unable to read the information about the Kong API Gateway. Please refer to the documentation for further "
             "instructions: KONG_INFORMATION_INVALID "
         )
         sys.exit(1)
-    _gateway_reachable = asyncio.run(
-        tools.is_host_available(_gateway_information.hostname, _gateway_information.admin_port)
+    logging.info("Checking the connection to the database and the api gateway")
+    _database_port = 5432 if _database_settings.dsn.port is None else int(_database_settings.dsn.port)
+    _database_available, _gateway_reachable = asyncio.run(
+        _check_hosts(
+            (_database_settings.dsn.host, _database_port),
+            (_gateway_information.hostname, _gateway_information.admin_port),
+        )
     )
+    if not _database_available:
+        logging.critical(
+            "The database is not available. Since this service requires an access to the database the service will "
+            "not start"
+        )
+        sys.exit(2)
     if not _gateway_reachable:
         logging.critical("The api gateway is not available. Since the service needs to register itself on the ")
         sys.exit(2)
     if not database.engine.dialect.has_schema(database.engine, "authorization"):
         logging.info("Creating the 'authorization' schema in the specified database.")
-        database.engine.execute(sqlalchemy.schema.CreateSchema("authorization"))
-        database.tables.initialize()
-        database.helpers.create_initial_data(pathlib.Path("./configuration/scopes.json").absolute())
+        # Create the schema, the tables and the initial data in one transaction to never leave a half-seeded database
+        with database.engine.begin() as connection:
+            connection.execute(sqlalchemy.schema.CreateSchema("authorization"))
+            database.tables.initialize(connection)
+            database.helpers.create_initial_data(connection)
     else:
         database.tables.initialize()
-        required_scopes: list[dict] = orjson.loads(open("./configuration/scopes.json").read())
-        for scope in required_scopes:
-            if database.crud.get_scope(scope.get("scopeStringValue")) is None:
-                _scope = models.requests.ScopeCreationData(
-                    name=scope.get("name"),
-                    description=scope.get("description"),
-                    scope_string_value=scope.get("scopeStringValue"),
-                )
-                database.crud.store_new_scope(_scope)
-        # Get the length of the user database entries
-        users = database.crud.get_user_accounts()
-        if len(users) == 0:
+        database.crud.store_missing_scopes(configuration.get_required_scopes())
+        # Check for the presence of any user and of an administrator in a single query
+        _any_account_exists, _administrator_exists = database.crud.check_user_accounts()
+        if not _any_account_exists:
             logging.critical("No user present in the database. The service may not work as expected.")
+        elif not _administrator_exists:
+            logging.warning("No user with the 'administration' scope present. The service can not be administrated.")
+    # Close the connections opened by the master process, since the forked workers may not share them
+    database.engine.dispose()
 
 
-def when_ready(server):
-    # %% Register at the Kong gateway
-    _gateway_information = configuration.KongGatewayInformation()
-    logging.debug("Read the following information about the gateway:\n%s", _gateway_information.json(indent=2))
+def _register_upstream():
+    """Register the upstream of this service and the target of this container in the api gateway"""
     # Try to get information about the upstream
     upstream_information_request = tools.query_kong(
         f"/upstreams/upstream_{_service_settings.name}", enums.HTTPMethod.GET
@@ -111,19 +147,44 @@ def when_ready(server):
         if upstream_creation.status_code == 201:
             logging.info(
                 "Created a new upstream for this service:\n%s",
-                orjson.dumps(upstream_creation.json(), option=orjson.OPT_INDENT_2),
+                _PrettyJSON(upstream_creation),
             )
         else:
             logging.debug(
                 f"Received a {upstream_creation.status_code} from the gateway:\n%s",
-                orjson.dumps(upstream_creation.json(), option=orjson.OPT_INDENT_2),
+                _PrettyJSON(upstream_creation),
             )
     elif upstream_information_request.status_code == 200:
         logging.debug(
             "Found the following upstream information for this service:\n%s",
-            orjson.dumps(upstream_information_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+            _PrettyJSON(upstream_information_request),
         )
+    # Determine the ip address of the service container
+    ip_address = _container_ip_address()
+    # Request information about the available targets
+    upstream_target_information_request = tools.query_kong(
+        f"/upstreams/upstream_{_service_settings.name}/targets", enums.HTTPMethod.GET
+    )
+    upstream_target_information = orjson.loads(upstream_target_information_request.content)
+    container_target = f"{ip_address}:{_service_settings.http_port}"
+    container_listed = any(target["target"] == container_target for target in upstream_target_information["data"])
+    if not container_listed:
+        upstream_target_creation_data = {"target": container_target}
+        upstream_creation_request = tools.query_kong(
+            f"/upstreams/upstream_{_service_settings.name}/targets",
+            enums.HTTPMethod.POST,
+            upstream_target_creation_data,
+        )
+        if upstream_creation_request.status_code == 201:
+            logging.info(
+                "Created a new upstream target for this service:\n%s",
+                _PrettyJSON(upstream_creation_request),
+            )
 
+
+def _register_service():
+    """Register the service entry and the route of this service in the api gateway"""
+    _gateway_information = configuration.get_kong_gateway_information()
     service_information_request = tools.query_kong(f"/services/service_{_service_settings.name}", enums.HTTPMethod.GET)
     if service_information_request.status_code == 404:
         logging.warning("No service entry found for this service. Creating a new entry in the API gateway...")
@@ -135,12 +196,12 @@ def when_ready(server):
         if service_creation_request.status_code == 201:
             logging.info(
                 "Created a new entry for this service:\n%s",
-                orjson.dumps(service_creation_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+                _PrettyJSON(service_creation_request),
             )
     elif service_information_request.status_code == 200:
         logging.debug(
             "Found the following information for this service:\n%s",
-            orjson.dumps(service_information_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+            _PrettyJSON(service_information_request),
         )
     route_information_request = tools.query_kong(
         f"/services/service_" f"{_service_settings.name}/routes/{_gateway_information.service_path_slug}",
@@ -160,37 +221,15 @@ def when_ready(server):
         if route_creation_request.status_code == 201:
             logging.info(
                 "Created a new route for this service:\n%s",
-                orjson.dumps(route_creation_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
-            )
-    # Determine the ip address of the service container
-    ip_address = socket.gethostbyname(socket.gethostname())
-    # Request information about the available targets
-    upstream_target_information_request = tools.query_kong(
-        f"/upstreams/upstream_{_service_settings.name}/targets", enums.HTTPMethod.GET
-    )
-    upstream_target_information = upstream_target_information_request.json()
-    container_listed = any(
-        [
-            target["target"] == f"{ip_address}:{_service_settings.http_port}"
-            for target in upstream_target_information["data"]
-        ]
-    )
-    if not container_listed:
-        upstream_target_creation_data = {"target": f"{ip_address}:{_service_settings.http_port}"}
-        upstream_creation_request = tools.query_kong(
-            f"/upstreams/upstream_{_service_settings.name}/targets",
-            enums.HTTPMethod.POST,
-            upstream_target_creation_data,
-        )
-        if upstream_creation_request.status_code == 201:
-            logging.info(
-                "Created a new upstream target for this service:\n%s",
-                orjson.dumps(upstream_creation_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+                _PrettyJSON(route_creation_request),
             )
+
+
+def _register_consumer():
+    """Register the consumer and the oauth2 credentials of this service in the api gateway"""
     consumer_information_request = tools.query_kong("/consumers", enums.HTTPMethod.GET)
-    consumer_exists = any(
-        [consumer["custom_id"] == "authorization-service" for consumer in consumer_information_request.json()["data"]]
-    )
+    consumers = orjson.loads(consumer_information_request.content)["data"]
+    consumer_exists = any(consumer["custom_id"] == "authorization-service" for consumer in consumers)
     _consumer_id = None
     if not consumer_exists:
         consumer_creation_request_data = {"custom_id": "authorization-service"}
@@ -200,23 +239,19 @@ def when_ready(server):
         if consumer_creation_request.status_code == 201:
             logging.info(
                 "Created new consumer for this service:\n%s",
-                orjson.dumps(consumer_creation_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+                _PrettyJSON(consumer_creation_request),
             )
-            _consumer_id = consumer_creation_request.json()["id"]
+            _consumer_id = orjson.loads(consumer_creation_request.content)["id"]
     else:
-        _consumer_id = [
-            consumer["id"]
-            for consumer in consumer_information_request.json()["data"]
-            if consumer["custom_id"] == "authorization-service"
-        ][0]
+        _consumer_id = next(
+            consumer["id"] for consumer in consumers if consumer["custom_id"] == "authorization-service"
+        )
     consumer_credential_information_request = tools.query_kong(
         f"/consumers/{_consumer_id}/oauth2", method=enums.HTTPMethod.GET
     )
+    consumer_credentials = orjson.loads(consumer_credential_information_request.content)["data"]
     consumer_credentials_exists = any(
-        [
-            credential["consumer"]["id"] == _consumer_id
-            for credential in consumer_credential_information_request.json()["data"]
-        ]
+        credential["consumer"]["id"] == _consumer_id for credential in consumer_credentials
     )
     if not consumer_credentials_exists:
         consumer_credential_creation_request_data = {
@@ -231,27 +266,71 @@ def when_ready(server):
         if consumer_credential_creation_request.status_code == 201:
             logging.info(
                 "Created new consumer credentials for this service:\n%s",
-                orjson.dumps(consumer_credential_creation_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),
+                _PrettyJSON(consumer_credential_creation_request),
             )
-            credential_file = open("/.credential_id", "wt")
-            credential_file.write(consumer_credential_creation_request.json()["id"])
+            pathlib.Path("/.credential_id").write_text(orjson.loads(consumer_credential_creation_request.content)["id"])
     else:
         logging.debug(
-        "Received consumer credentials for this service:\n%s",
-                        orjson.dumps(consumer_information_request.json(), option=orjson.OPT_INDENT_2).decode("utf-8"),)
-        _credential_id = [
-            credential["id"]
-            for credential in consumer_credential_information_request.json()["data"]
-            if credential["consumer"]["id"] == _consumer_id
-        ][0]
-        credential_file = open("/.credential_id", "wt")
-        credential_file.write(_credential_id)
+            "Received consumer credentials for this service:\n%s",
+            _PrettyJSON(consumer_credential_information_request),
+        )
+        _credential_id = next(
+            credential["id"] for credential in consumer_credentials if credential["consumer"]["id"] == _consumer_id
+        )
+        pathlib.Path("/.credential_id").write_text(_credential_id)
+
+
+def _gateway_configured() -> bool:
+    """
+    Check if the service and the consumer have been registered in the api gateway by an earlier start of this
+    container and are still present
+
+    :return: True if the registration of the service and the consumer may be skipped
+    :rtype: bool
+    """
+    if not (_KONG_CONFIGURED_FILE.exists() and pathlib.Path("/.credential_id").exists()):
+        return False
+    return tools.query_kong(f"/services/service_{_service_settings.name}", enums.HTTPMethod.GET).status_code == 200
+
+
+def when_ready(server):
+    # %% Register at the Kong gateway
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "Read the following information about the gateway:\n%s",
+            configuration.get_kong_gateway_information().json(indent=2),
+        )
+    # The upstream target of this container is removed on exit and therefore always registered. The service and the
+    # consumer only need to be registered if an earlier start did not complete the registration
+    registration_functions = [_register_upstream]
+    if _gateway_configured():
+        logging.info("The service has already been registered in the api gateway. Only updating the upstream target")
+    else:
+        registration_functions.extend([_register_service, _register_consumer])
+    # The upstream, the service and the consumer do not depend on each other. Therefore, they are registered in
+    # parallel, so the startup only waits for the slowest chain of requests instead of the sum of all requests
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(registration_functions)) as executor:
+        registrations = [executor.submit(registration_function) for registration_function in registration_functions]
+    for registration in registrations:
+        registration.result()
+    _KONG_CONFIGURED_FILE.touch()
+
+
+def post_worker_init(worker):
+    # Use own connections to the gateway instead of the ones inherited from the master
+    tools.reset_kong_session()
+    database.warm_pool(configuration.get_database_configuration().pool_size)
 
 
 def on_exit(server):
-    _gateway_information = configuration.KongGatewayInformation()
-    ip_address = socket.gethostbyname(socket.gethostname())
-    upstream_deletion_request = requests.delete(
-        f"http://{_gateway_information.hostname}:{_gateway_information.admin_port}/upstreams/upstream_"
-        f"{_service_settings.name}/targets/{ip_address}:{_service_settings.http_port}",
-    )
+    ip_address = _container_ip_address()
+    # Remove this container from the upstream targets. The request is bounded by a short timeout to prevent an
+    # unreachable gateway from blocking the shutdown
+    try:
+        tools.query_kong(
+            f"/upstreams/upstream_{_service_settings.name}/targets/{ip_address}:{_service_settings.http_port}",
+            enums.HTTPMethod.DELETE,
+            timeout=2,
+        )
+    except requests.RequestException as e:
+        logging.warning("Unable to remove the upstream target of this service from the api gateway", exc_info=e)
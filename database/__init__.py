@@ -1,4 +1,5 @@
 """Database module used for ORM descriptions of the used tables"""
+import concurrent.futures
 import logging
 import sys
 
@@ -6,14 +7,36 @@ from pydantic import ValidationError
 from sqlalchemy import create_engine
 
 import database.crud
-from configuration import DatabaseConfiguration
+from configuration import get_database_configuration
 
 __logger = logging.getLogger("DB")
 # Read the service configuration to be able to set the database connection
 try:
-    __settings = DatabaseConfiguration()
+    __settings = get_database_configuration()
 except ValidationError as error:
     logging.error("The configuration for the database connection could not be read")
     sys.exit(3)
 
-engine = create_engine(url=__settings.dsn, pool_recycle=120)
+engine = create_engine(
+    url=__settings.dsn,
+    pool_size=__settings.pool_size,
+    max_overflow=__settings.max_overflow,
+    pool_recycle=__settings.pool_recycle,
+    pool_pre_ping=__settings.pool_pre_ping,
+    connect_args={"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 5},
+)
+
+
+def warm_pool(connection_count: int) -> None:
+    """
+    Open the connections of the connection pool in advance, so the first requests do not need to wait for the
+    connections to be established
+
+    :param connection_count: The number of connections which shall be opened
+    :type connection_count: int
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=connection_count) as executor:
+        connections = list(executor.map(lambda _: engine.connect(), range(connection_count)))
+    # Closing the connections returns them to the pool where they are kept open
+    for connection in connections:
+        connection.close()
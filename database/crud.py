@@ -1,9 +1,13 @@
 import datetime
 import hashlib
 import http
+import itertools
+import threading
 import typing
 
-import passlib.hash
+import cachetools
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.engine
 import sqlalchemy.sql
 
 import database
@@ -13,8 +17,41 @@ import models.common
 import models.requests
 import models.responses
 
+__scope_map_cache = cachetools.TTLCache(maxsize=1, ttl=60)
+"""Cache for all scopes keyed by their internal id and their string value since the scopes change rarely"""
+
+
+def _clear_scope_cache() -> None:
+    """Clear the cached scope map after the scopes have been changed"""
+    __scope_map_cache.clear()
+
+
+def _unique_scopes(scopes: typing.Iterable[models.common.Scope]) -> list[models.common.Scope]:
+    """
+    Remove repeated scopes while keeping their order, since the mapping tables allow a scope only once per entry
+
+    :param scopes: The scopes which may contain repetitions
+    :type scopes: typing.Iterable[models.common.Scope]
+    :return: The scopes without repetitions
+    :rtype: list[models.common.Scope]
+    """
+    return list({scope.id: scope for scope in scopes}.values())
+
 
 # %% Operations for getting users
+__user_account_by_username_query = sqlalchemy.sql.select(
+    [database.tables.accounts],
+    database.tables.accounts.c.username == sqlalchemy.sql.bindparam("identifier"),
+)
+"""The lookup of an account by its username, which is built once to skip the construction on every login"""
+
+__user_account_by_id_query = sqlalchemy.sql.select(
+    [database.tables.accounts],
+    database.tables.accounts.c.id == sqlalchemy.sql.bindparam("identifier"),
+)
+"""The lookup of an account by its primary key, which is built once to skip the construction on every token refresh"""
+
+
 def get_user_account(identifier: typing.Union[str, int]):
     """
     Get the user account specified in the database
@@ -25,18 +62,12 @@ def get_user_account(identifier: typing.Union[str, int]):
     :rtype:
     """
     if type(identifier) is str:
-        user_query = sqlalchemy.sql.select(
-            [database.tables.accounts],
-            database.tables.accounts.c.username == identifier,
-        )
+        user_query = __user_account_by_username_query
     elif type(identifier) is int:
-        user_query = sqlalchemy.sql.select(
-            [database.tables.accounts],
-            database.tables.accounts.c.id == identifier,
-        )
+        user_query = __user_account_by_id_query
     else:
         raise TypeError("Expected identifier to by either string or int")
-    user_query_result = database.engine.execute(user_query).first()
+    user_query_result = database.engine.execute(user_query, {"identifier": identifier}).first()
     if user_query_result is None:
         return user_query_result
     return models.common.UserAccount(
@@ -49,6 +80,61 @@ def get_user_account(identifier: typing.Union[str, int]):
     )
 
 
+def get_user_account_with_scopes(
+    identifier: typing.Union[str, int]
+) -> typing.Optional[tuple[models.common.UserAccount, list[models.common.Scope]]]:
+    """
+    Get the user account and its scopes with a single query
+
+    :param identifier: The username or the internal id of the account
+    :type identifier: typing.Union[str, int]
+    :return: The account and its scopes or None if the account does not exist
+    :rtype: typing.Optional[tuple[models.common.UserAccount, list[models.common.Scope]]]
+    """
+    if type(identifier) is str:
+        account_filter = database.tables.accounts.c.username == identifier
+    elif type(identifier) is int:
+        account_filter = database.tables.accounts.c.id == identifier
+    else:
+        raise TypeError("Expected identifier to by either string or int")
+    user_query = (
+        sqlalchemy.sql.select([database.tables.accounts, database.tables.scopes])
+        .select_from(
+            database.tables.accounts.outerjoin(
+                database.tables.account_scopes,
+                database.tables.account_scopes.c.accountID == database.tables.accounts.c.id,
+            ).outerjoin(
+                database.tables.scopes,
+                database.tables.scopes.c.id == database.tables.account_scopes.c.scopeID,
+            )
+        )
+        .where(account_filter)
+    )
+    user_query_results = database.engine.execute(user_query).all()
+    if len(user_query_results) == 0:
+        return None
+    user_query_result = user_query_results[0]
+    account = models.common.UserAccount(
+        id=user_query_result[0],
+        first_name=user_query_result[1],
+        last_name=user_query_result[2],
+        username=user_query_result[3],
+        password=user_query_result[4],
+        active=user_query_result[5],
+    )
+    account_scopes = [
+        models.common.Scope(
+            id=result[6],
+            name=result[7],
+            description=result[8],
+            scope_string_value=result[9],
+        )
+        for result in user_query_results
+        if result[6] is not None
+    ]
+    return account, account_scopes
+
+
 def store_changed_user(user: models.common.UserAccount):
     update_user_query = (
         sqlalchemy.sql.update(database.tables.accounts)
@@ -64,54 +150,220 @@ def store_changed_user(user: models.common.UserAccount):
     database.engine.execute(update_user_query)
 
 
-def delete_user(user):
-    delete_user_query = sqlalchemy.sql.delete(database.tables.accounts).where(
-        database.tables.accounts.c.id == user.id,
+def patch_user(user_id: int, values: dict[str, typing.Any]) -> typing.Optional[models.common.UserAccount]:
+    """
+    Update only the supplied columns of the user account and return the stored account
+
+    :param user_id: The internal id of the account
+    :type user_id: int
+    :param values: The new values keyed by the column names
+    :type values: dict[str, typing.Any]
+    :return: The account after the update or None if the account does not exist
+    :rtype: typing.Optional[models.common.UserAccount]
+    """
+    update_user_query = (
+        sqlalchemy.sql.update(database.tables.accounts)
+        .where(database.tables.accounts.c.id == user_id)
+        .values(**values)
+        .returning(database.tables.accounts)
+    )
+    update_user_query_result = database.engine.execute(update_user_query).first()
+    if update_user_query_result is None:
+        return None
+    return models.common.UserAccount(
+        id=update_user_query_result[0],
+        first_name=update_user_query_result[1],
+        last_name=update_user_query_result[2],
+        username=update_user_query_result[3],
+        password=update_user_query_result[4],
+        active=update_user_query_result[5],
+    )
+
+
+def delete_user(identifier: typing.Union[str, int]) -> bool:
+    """
+    Delete the user account specified by the identifier without reading it first
+
+    :param identifier: The username or the internal id of the account
+    :type identifier: typing.Union[str, int]
+    :return: True if an account has been deleted
+    :rtype: bool
+    """
+    if type(identifier) is str:
+        delete_user_query = sqlalchemy.sql.delete(database.tables.accounts).where(
+            database.tables.accounts.c.username == identifier,
+        )
+    elif type(identifier) is int:
+        delete_user_query = sqlalchemy.sql.delete(database.tables.accounts).where(
+            database.tables.accounts.c.id == identifier,
+        )
+    else:
+        raise TypeError("Expected identifier to by either string or int")
+    return database.engine.execute(delete_user_query).rowcount > 0
+
+
+def _user_accounts_with_scopes_query() -> sqlalchemy.sql.Select:
+    """
+    Build the query selecting all user accounts joined with their scopes, ordered by the account
+
+    :return: The query returning one row per account and scope
+    :rtype: sqlalchemy.sql.Select
+    """
+    return (
+        sqlalchemy.sql.select([database.tables.accounts, database.tables.scopes])
+        .select_from(
+            database.tables.accounts.outerjoin(
+                database.tables.account_scopes,
+                database.tables.account_scopes.c.accountID == database.tables.accounts.c.id,
+            ).outerjoin(
+                database.tables.scopes,
+                database.tables.scopes.c.id == database.tables.account_scopes.c.scopeID,
+            )
+        )
+        .order_by(database.tables.accounts.c.id)
     )
-    database.engine.execute(delete_user_query)
 
 
-def get_user_accounts():
-    user_account_query = sqlalchemy.sql.select(database.tables.accounts)
-    user_account_query_results = database.engine.execute(user_account_query).all()
-    user_accounts: list[models.responses.UserAccount] = []
-    for user_account_query_result in user_account_query_results:
+def _group_user_accounts(
+    user_account_query_results: typing.Iterable[sqlalchemy.engine.Row],
+) -> typing.Iterator[models.responses.UserAccount]:
+    """
+    Group the rows returned by the query from ``_user_accounts_with_scopes_query`` into user accounts
+
+    :param user_account_query_results: The rows ordered by the account
+    :type user_account_query_results: typing.Iterable[sqlalchemy.engine.Row]
+    :return: An iterator yielding the user accounts including their scopes
+    :rtype: typing.Iterator[models.responses.UserAccount]
+    """
+    for _, account_rows in itertools.groupby(user_account_query_results, key=lambda row: row[0]):
+        account_rows = list(account_rows)
         account = models.common.UserAccount(
-            id=user_account_query_result[0],
-            first_name=user_account_query_result[1],
-            last_name=user_account_query_result[2],
-            username=user_account_query_result[3],
-            password=user_account_query_result[4],
-            active=user_account_query_result[5],
+            id=account_rows[0][0],
+            first_name=account_rows[0][1],
+            last_name=account_rows[0][2],
+            username=account_rows[0][3],
+            password=account_rows[0][4],
+            active=account_rows[0][5],
         )
-        account_scopes = get_user_scopes(account)
-        user_accounts.append(models.responses.UserAccount(**account.dict(), scopes=account_scopes))
-    return user_accounts
+        account_scopes = [
+            models.common.Scope(
+                id=account_row[6],
+                name=account_row[7],
+                description=account_row[8],
+                scope_string_value=account_row[9],
+            )
+            for account_row in account_rows
+            if account_row[6] is not None
+        ]
+        yield models.responses.UserAccount.from_account(account, account_scopes)
+
+
+def get_user_accounts() -> list[models.responses.UserAccount]:
+    """
+    Get all user accounts including their scopes using a single query
 
+    :return: The user accounts including their scopes
+    :rtype: list[models.responses.UserAccount]
+    """
+    return list(_group_user_accounts(database.engine.execute(_user_accounts_with_scopes_query())))
 
-def store_new_user(information: models.requests.AccountCreationInformation):
-    user_insert_query = sqlalchemy.sql.insert(database.tables.accounts).values(
-        firstName=information.first_name,
-        lastName=information.last_name,
-        username=information.username,
-        password=passlib.hash.argon2.using(type="ID").hash(information.password.get_secret_value()),
-        active=True,
+
+def check_user_accounts() -> tuple[bool, bool]:
+    """
+    Check if any user account and any account with the administration scope exist using a single query
+
+    :return: If any account exists and if an account with the administration scope exists
+    :rtype: tuple[bool, bool]
+    """
+    accounts = database.tables.accounts
+    account_scopes = database.tables.account_scopes
+    scopes = database.tables.scopes
+    any_account_query = sqlalchemy.sql.select([accounts.c.id]).exists()
+    administrator_query = (
+        sqlalchemy.sql.select([account_scopes.c.accountID])
+        .select_from(account_scopes.join(scopes, scopes.c.id == account_scopes.c.scopeID))
+        .where(scopes.c.value == "administration")
+        .exists()
     )
-    database.engine.execute(user_insert_query)
-    user = get_user_account(information.username)
-    scopes = [get_scope(i) for i in information.scopes]
-    if len(scopes) != len(information.scopes):
+    account_check_result = database.engine.execute(sqlalchemy.sql.select([any_account_query, administrator_query]))
+    return tuple(account_check_result.first())
+
+
+def stream_user_accounts() -> typing.Iterator[models.responses.UserAccount]:
+    """
+    Iterate over all user accounts using a server-side cursor, so the accounts are not loaded into memory at once
+
+    :return: An iterator yielding the user accounts including their scopes
+    :rtype: typing.Iterator[models.responses.UserAccount]
+    """
+    with database.engine.connect() as connection:
+        yield from _group_user_accounts(
+            connection.execution_options(stream_results=True).execute(_user_accounts_with_scopes_query())
+        )
+
+
+def store_new_user(
+    information: models.requests.AccountCreationInformation, password_hash: str
+) -> tuple[models.common.UserAccount, list[models.common.Scope]]:
+    """
+    Store a new user account and assign the requested scopes to it
+
+    :param information: The information about the new account
+    :type information: models.requests.AccountCreationInformation
+    :param password_hash: The hash of the password of the new account
+    :type password_hash: str
+    :return: The stored account and its scopes
+    :rtype: tuple[models.common.UserAccount, list[models.common.Scope]]
+    """
+    user_insert_query = (
+        sqlalchemy.sql.insert(database.tables.accounts)
+        .values(
+            firstName=information.first_name,
+            lastName=information.last_name,
+            username=information.username,
+            password=password_hash,
+            active=True,
+        )
+        .returning(database.tables.accounts)
+    )
+    scope_map = get_scopes_by_identifiers(information.scopes)
+    scopes = [scope_map.get(i) for i in information.scopes]
+    if None in scopes:
         raise exceptions.APIException(
             "INVALID_SCOPE_REQUESTED",
             "Invalid scope requested for new account",
             "You tried to request a scope which is not in the database",
             http.HTTPStatus.BAD_REQUEST,
         )
-    set_user_scopes(user, scopes)
+    scopes = _unique_scopes(scopes)
+    # Store the account and its scope assignments in one transaction to prevent accounts without scopes
+    with database.engine.begin() as connection:
+        user_insert_query_result = connection.execute(user_insert_query).first()
+        user = models.common.UserAccount(
+            id=user_insert_query_result[0],
+            first_name=user_insert_query_result[1],
+            last_name=user_insert_query_result[2],
+            username=user_insert_query_result[3],
+            password=user_insert_query_result[4],
+            active=user_insert_query_result[5],
+        )
+        if len(scopes) > 0:
+            connection.execute(
+                sqlalchemy.sql.insert(database.tables.account_scopes),
+                [{"accountID": user.id, "scopeID": scope.id} for scope in scopes],
+            )
+    return user, scopes
 
 
 # %% Operations for the scopes
-def get_scope(identifier: typing.Union[str, int]):
+def get_scope(identifier: typing.Union[str, int], use_cache: bool = True):
+    # The scopes change rarely, therefore the cached scopes are used if they contain the requested scope. Scopes
+    # created by other workers are not contained in the cache yet and are therefore read from the database. Callers
+    # about to change the scope skip the cache, since other workers may have changed or deleted the scope meanwhile
+    if use_cache:
+        cached_scope = _get_scope_map().get(identifier)
+        if cached_scope is not None:
+            return cached_scope
     if type(identifier) is str:
         scope_query = sqlalchemy.sql.select(
             [database.tables.scopes],
@@ -135,38 +387,115 @@ def get_scope(identifier: typing.Union[str, int]):
     )
 
 
+@cachetools.cached(__scope_map_cache, lock=threading.Lock())
+def _get_scope_map() -> dict[typing.Union[str, int], models.common.Scope]:
+    """
+    Get all scopes keyed by their internal id and by their scope string value. The scopes are cached for up to a minute
+
+    :return: The scopes keyed by their internal id and by their scope string value
+    :rtype: dict[typing.Union[str, int], models.common.Scope]
+    """
+    scopes: dict[typing.Union[str, int], models.common.Scope] = {}
+    for scope_query_result in database.engine.execute(sqlalchemy.sql.select([database.tables.scopes])).all():
+        scope = models.common.Scope(
+            id=scope_query_result[0],
+            name=scope_query_result[1],
+            description=scope_query_result[2],
+            scope_string_value=scope_query_result[3],
+        )
+        scopes[scope.id] = scope
+        scopes[scope.scope_string_value] = scope
+    return scopes
+
+
+def get_scopes_by_identifiers(
+    identifiers: typing.Iterable[typing.Union[str, int]]
+) -> dict[typing.Union[str, int], models.common.Scope]:
+    """
+    Get all scopes matching the supplied identifiers from the cached scope map
+
+    Identifiers missing in the cached scope map are looked up in the database with a single query, since the scope may
+    have been created by another worker after the scope map has been cached
+
+    :param identifiers: The scope string values and internal ids of the scopes
+    :type identifiers: typing.Iterable[typing.Union[str, int]]
+    :return: The found scopes keyed by the identifiers
+    :rtype: dict[typing.Union[str, int], models.common.Scope]
+    """
+    scope_map = _get_scope_map()
+    found_scopes = {}
+    missing_values = set()
+    missing_ids = set()
+    for identifier in identifiers:
+        if identifier in scope_map:
+            found_scopes[identifier] = scope_map[identifier]
+        elif type(identifier) is str:
+            missing_values.add(identifier)
+        elif type(identifier) is int:
+            missing_ids.add(identifier)
+    if len(missing_values) == 0 and len(missing_ids) == 0:
+        return found_scopes
+    scopes = database.tables.scopes
+    missing_scope_query = sqlalchemy.sql.select([scopes]).where(
+        sqlalchemy.sql.or_(scopes.c.value.in_(missing_values), scopes.c.id.in_(missing_ids))
+    )
+    for scope_query_result in database.engine.execute(missing_scope_query).all():
+        scope = models.common.Scope(
+            id=scope_query_result[0],
+            name=scope_query_result[1],
+            description=scope_query_result[2],
+            scope_string_value=scope_query_result[3],
+        )
+        if scope.id in missing_ids:
+            found_scopes[scope.id] = scope
+        if scope.scope_string_value in missing_values:
+            found_scopes[scope.scope_string_value] = scope
+    return found_scopes
+
+
 def get_user_scopes(user: models.common.UserAccount) -> list[models.common.Scope]:
-    scope_id_query = sqlalchemy.sql.select(
-        [database.tables.account_scopes.c.scopeID],
-        database.tables.account_scopes.c.accountID == user.id,
+    scope_query = (
+        sqlalchemy.sql.select([database.tables.scopes])
+        .select_from(
+            database.tables.scopes.join(
+                database.tables.account_scopes,
+                database.tables.account_scopes.c.scopeID == database.tables.scopes.c.id,
+            )
+        )
+        .where(database.tables.account_scopes.c.accountID == user.id)
     )
-    scope_id_query_result = database.engine.execute(scope_id_query).all()
-    scope_ids = [result[0] for result in scope_id_query_result]
-    return [get_scope(scope_id) for scope_id in scope_ids]
+    return [
+        models.common.Scope(
+            id=result[0],
+            name=result[1],
+            description=result[2],
+            scope_string_value=result[3],
+        )
+        for result in database.engine.execute(scope_query).all()
+    ]
 
 
 def set_user_scopes(user: models.common.UserAccount, scopes: list[models.common.Scope]):
-    # Delete all scopes of the user
+    """
+    Replace the scopes of the user in a single transaction
+
+    :param user: The user whose scopes shall be replaced
+    :type user: models.common.UserAccount
+    :param scopes: The new scopes of the user
+    :type scopes: list[models.common.Scope]
+    """
     delete_scope_assignment_query = sqlalchemy.sql.delete(database.tables.account_scopes).where(
         database.tables.account_scopes.c.accountID == user.id
     )
-    database.engine.execute(delete_scope_assignment_query)
-    # Now assign the scopes again
-    for scope in scopes:
-        insert_scope_assignment_query = sqlalchemy.sql.insert(
-            database.tables.account_scopes
-        ).values(scopeID=scope.id, accountID=user.id)
-        database.engine.execute(insert_scope_assignment_query)
-
-
-def get_access_token_scopes(token: models.common.TokenInformation) -> list[models.common.Scope]:
-    scope_id_query = sqlalchemy.sql.select(
-        [database.tables.access_token_scopes.c.scopeID],
-        database.tables.access_token_scopes.c.tokenID == token.id,
-    )
-    scope_id_query_result = database.engine.execute(scope_id_query).all()
-    scope_ids = [result[0] for result in scope_id_query_result]
-    return [get_scope(scope_id) for scope_id in scope_ids]
+    with database.engine.begin() as connection:
+        # Delete all scopes of the user
+        connection.execute(delete_scope_assignment_query)
+        # Now assign the scopes again
+        if len(scopes) > 0:
+            connection.execute(
+                sqlalchemy.sql.insert(database.tables.account_scopes),
+                [{"accountID": user.id, "scopeID": scope.id} for scope in _unique_scopes(scopes)],
+            )
 
 
 def get_refresh_token_scopes(token: models.common.TokenInformation) -> list[models.common.Scope]:
@@ -179,29 +508,106 @@ def get_refresh_token_scopes(token: models.common.TokenInformation) -> list[mode
     return [get_scope(scope_id) for scope_id in scope_ids]
 
 
-def store_changed_scope(scope: models.common.Scope):
+def patch_scope(scope_id: int, values: dict[str, typing.Any]) -> typing.Optional[models.common.Scope]:
+    """
+    Update only the supplied columns of the scope and return the stored scope
+
+    :param scope_id: The internal id of the scope
+    :type scope_id: int
+    :param values: The new values keyed by the column names
+    :type values: dict[str, typing.Any]
+    :return: The scope after the update or None if the scope does not exist
+    :rtype: typing.Optional[models.common.Scope]
+    """
     update_scope_query = (
         sqlalchemy.sql.update(database.tables.scopes)
-        .where(database.tables.scopes.c.id == scope.id)
-        .values(name=scope.name, description=scope.description)
+        .where(database.tables.scopes.c.id == scope_id)
+        .values(**values)
+        .returning(database.tables.scopes)
     )
-    database.engine.execute(update_scope_query)
+    update_scope_query_result = database.engine.execute(update_scope_query).first()
+    _clear_scope_cache()
+    if update_scope_query_result is None:
+        return None
+    return models.common.Scope(
+        id=update_scope_query_result[0],
+        name=update_scope_query_result[1],
+        description=update_scope_query_result[2],
+        scope_string_value=update_scope_query_result[3],
+    )
+
+
+def delete_scope(identifier: typing.Union[str, int]) -> bool:
+    """
+    Delete the scope specified by the identifier without reading it first
+
+    :param identifier: The scope string value or the internal id of the scope
+    :type identifier: typing.Union[str, int]
+    :return: True if a scope has been deleted
+    :rtype: bool
+    """
+    if type(identifier) is str:
+        delete_scope_query = sqlalchemy.sql.delete(database.tables.scopes).where(
+            database.tables.scopes.c.value == identifier
+        )
+    elif type(identifier) is int:
+        delete_scope_query = sqlalchemy.sql.delete(database.tables.scopes).where(
+            database.tables.scopes.c.id == identifier
+        )
+    else:
+        raise TypeError("Expected identifier to by either string or int")
+    scope_deleted = database.engine.execute(delete_scope_query).rowcount > 0
+    _clear_scope_cache()
+    return scope_deleted
 
 
-def delete_scope(scope: models.common.Scope):
-    update_scope_query = sqlalchemy.sql.delete(database.tables.scopes).where(
-        database.tables.scopes.c.id == scope.id
+def store_new_scope(scope_data: models.requests.ScopeCreationData) -> models.common.Scope:
+    scope_insert_query = (
+        sqlalchemy.sql.insert(database.tables.scopes)
+        .values(
+            name=scope_data.name,
+            description=scope_data.description,
+            value=scope_data.scope_string_value,
+        )
+        .returning(database.tables.scopes)
+    )
+    scope_insert_query_result = database.engine.execute(scope_insert_query).first()
+    _clear_scope_cache()
+    return models.common.Scope(
+        id=scope_insert_query_result[0],
+        name=scope_insert_query_result[1],
+        description=scope_insert_query_result[2],
+        scope_string_value=scope_insert_query_result[3],
     )
-    database.engine.execute(update_scope_query)
 
 
-def store_new_scope(scope_data: models.requests.ScopeCreationData):
-    scope_insert_query = sqlalchemy.sql.insert(database.tables.scopes).values(
-        name=scope_data.name,
-        description=scope_data.description,
-        value=scope_data.scope_string_value,
+def store_missing_scopes(
+    scopes: typing.Iterable[models.requests.ScopeCreationData],
+    connection: typing.Optional[sqlalchemy.engine.Connection] = None,
+) -> None:
+    """
+    Store all scopes which are not present in the database yet using a single statement
+
+    :param scopes: The scopes which shall be present in the database
+    :type scopes: typing.Iterable[models.requests.ScopeCreationData]
+    :param connection: The connection used for storing the scopes. If it is omitted, the engine is used
+    :type connection: typing.Optional[sqlalchemy.engine.Connection]
+    """
+    scope_rows = [
+        {"name": scope.name, "description": scope.description, "value": scope.scope_string_value} for scope in scopes
+    ]
+    if len(scope_rows) == 0:
+        return
+    scope_insert_query = (
+        sqlalchemy.dialects.postgresql.insert(database.tables.scopes)
+        .values(scope_rows)
+        .on_conflict_do_nothing(index_elements=[database.tables.scopes.c.value])
     )
-    database.engine.execute(scope_insert_query)
+    if connection is None:
+        database.engine.execute(scope_insert_query)
+    else:
+        connection.execute(scope_insert_query)
+    _clear_scope_cache()
 
 
 def get_scopes():
@@ -210,11 +616,39 @@ def get_scopes():
     return [get_scope(s[0]) for s in scope_query_result]
 
 
+def stream_scopes() -> typing.Iterator[models.common.Scope]:
+    """
+    Iterate over all scopes using a server-side cursor, so the scopes are not loaded into memory at once
+
+    :return: An iterator yielding the scopes
+    :rtype: typing.Iterator[models.common.Scope]
+    """
+    scope_query = sqlalchemy.sql.select([database.tables.scopes])
+    with database.engine.connect() as connection:
+        for scope_query_result in connection.execution_options(stream_results=True).execute(scope_query):
+            yield models.common.Scope(
+                id=scope_query_result[0],
+                name=scope_query_result[1],
+                description=scope_query_result[2],
+                scope_string_value=scope_query_result[3],
+            )
+
+
+def get_scope_string_values() -> list[str]:
+    """
+    Get the string values of all scopes. The values are taken from the cached scope map
+
+    :return: The string values of all scopes
+    :rtype: list[str]
+    """
+    return [key for key in _get_scope_map() if isinstance(key, str)]
+
+
 # %% Operations for manipulating access tokens
 def insert_token_set(user: models.common.UserAccount, token_set: models.common.TokenSet) -> bool:
     current_time = datetime.datetime.now()
     insert_access_token_query = sqlalchemy.sql.insert(database.tables.access_token).values(
-        value=hashlib.sha3_224(str(token_set.access_token).encode("utf-8")).hexdigest(),
+        value=hashlib.sha3_224(token_set.access_token.encode("utf-8")).hexdigest(),
         active=True,
         expires=current_time + datetime.timedelta(seconds=token_set.expires_in),
         created=current_time,
@@ -226,14 +660,10 @@ def insert_token_set(user: models.common.UserAccount, token_set: models.common.T
         expires=current_time + datetime.timedelta(days=3),
         accountID=user.id,
     )
-    insert_access_token_result = database.engine.execute(insert_access_token_query)
-    insert_refresh_token_result = database.engine.execute(insert_refresh_token_query)
-    internal_access_token_id = insert_access_token_result.inserted_primary_key[0]
-    internal_refresh_token_id = insert_refresh_token_result.inserted_primary_key[0]
     # Access the scope ids to populate the values for the token scopes
-    scopes: list[models.common.Scope] = []
-    for scope in token_set.scopes.split(" "):
-        scopes.append(get_scope(scope))
+    requested_scopes = token_set.scopes.split()
+    scope_map = get_scopes_by_identifiers(requested_scopes)
+    scopes = [scope_map.get(scope) for scope in requested_scopes]
     if None in scopes:
         raise exceptions.APIException(
             "INVALID_SCOPE_REQUESTED",
@@ -242,43 +672,124 @@ def insert_token_set(user: models.common.UserAccount, token_set: models.common.T
             "with your new access token",
             http.HTTPStatus.BAD_REQUEST,
         )
-    for scope in scopes:
-        insert_access_token_scope_query = sqlalchemy.sql.insert(
-            database.tables.access_token_scopes
-        ).values(tokenID=internal_access_token_id, scopeID=scope.id)
-        insert_refresh_token_scope_query = sqlalchemy.sql.insert(
-            database.tables.refresh_token_scopes
-        ).values(tokenID=internal_refresh_token_id, scopeID=scope.id)
-        database.engine.execute(insert_access_token_scope_query)
-        database.engine.execute(insert_refresh_token_scope_query)
+    scopes = _unique_scopes(scopes)
+    with database.engine.begin() as connection:
+        internal_access_token_id = connection.execute(insert_access_token_query).inserted_primary_key[0]
+        internal_refresh_token_id = connection.execute(insert_refresh_token_query).inserted_primary_key[0]
+        if len(scopes) > 0:
+            connection.execute(
+                sqlalchemy.sql.insert(database.tables.access_token_scopes),
+                [{"tokenID": internal_access_token_id, "scopeID": scope.id} for scope in scopes],
+            )
+            connection.execute(
+                sqlalchemy.sql.insert(database.tables.refresh_token_scopes),
+                [{"tokenID": internal_refresh_token_id, "scopeID": scope.id} for scope in scopes],
+            )
     return True
 
 
-def get_access_token_data(identifier: typing.Union[str, int]):
-    if type(identifier) is str:
-        access_token_query = sqlalchemy.sql.select(
-            [database.tables.access_token],
-            database.tables.access_token.c.value
-            == hashlib.sha3_224(identifier.encode("utf-8")).hexdigest(),
+def delete_token_set(token_set: models.common.TokenSet):
+    """
+    Delete the access and refresh token of the supplied token set
+
+    :param token_set: The token set which shall be deleted
+    :type token_set: models.common.TokenSet
+    """
+    delete_access_token_query = sqlalchemy.sql.delete(database.tables.access_token).where(
+        database.tables.access_token.c.value
+        == hashlib.sha3_224(token_set.access_token.encode("utf-8")).hexdigest()
+    )
+    delete_refresh_token_query = sqlalchemy.sql.delete(database.tables.refresh_token).where(
+        database.tables.refresh_token.c.value == hashlib.sha3_224(token_set.refresh_token.encode("utf-8")).hexdigest()
+    )
+    with database.engine.begin() as connection:
+        connection.execute(delete_access_token_query)
+        connection.execute(delete_refresh_token_query)
+
+
+def _build_access_token_context_query() -> sqlalchemy.sql.Select:
+    """
+    Build the query selecting an access token, its owner and its scopes by the hash of the token
+
+    :return: The query expecting the ``token_hash`` parameter
+    :rtype: sqlalchemy.sql.Select
+    """
+    access_token = database.tables.access_token
+    accounts = database.tables.accounts
+    access_token_scopes = database.tables.access_token_scopes
+    scopes = database.tables.scopes
+    token_context_query = (
+        sqlalchemy.sql.select(
+            [
+                access_token.c.id,
+                access_token.c.value,
+                access_token.c.active,
+                access_token.c.expires,
+                access_token.c.created,
+                access_token.c.accountID,
+                accounts.c.id,
+                accounts.c.firstName,
+                accounts.c.lastName,
+                accounts.c.username,
+                accounts.c.password,
+                accounts.c.active,
+                sqlalchemy.func.array_agg(scopes.c.value),
+            ]
         )
-    elif type(identifier) is int:
-        access_token_query = sqlalchemy.sql.select(
-            [database.tables.access_token],
-            database.tables.access_token.c.id == identifier,
+        .select_from(
+            access_token.outerjoin(accounts, accounts.c.id == access_token.c.accountID)
+            .outerjoin(access_token_scopes, access_token_scopes.c.tokenID == access_token.c.id)
+            .outerjoin(scopes, scopes.c.id == access_token_scopes.c.scopeID)
         )
-    else:
-        raise TypeError("Expected identifier to by either string or int")
-    access_token_query_result = database.engine.execute(access_token_query).first()
-    if access_token_query_result is None:
+        .where(access_token.c.value == sqlalchemy.sql.bindparam("token_hash"))
+        .group_by(access_token.c.id, accounts.c.id)
+    )
+    return token_context_query
+
+
+__access_token_context_query = _build_access_token_context_query()
+"""The query used for every authorized request, which is built once to skip the construction on every call"""
+
+
+def get_access_token_context(
+    token: str,
+) -> typing.Optional[
+    tuple[models.common.TokenInformation, typing.Optional[models.common.UserAccount], list[str]]
+]:
+    """
+    Get the access token, the account owning the token and the scopes of the token using a single query
+
+    :param token: The clear-text access token
+    :type token: str
+    :return: The token information, the owner of the token and the scope string values of the token or None if the
+        token does not exist
+    :rtype: typing.Optional[tuple]
+    """
+    token_context_query_result = database.engine.execute(
+        __access_token_context_query, {"token_hash": hashlib.sha3_224(token.encode("utf-8")).hexdigest()}
+    ).first()
+    if token_context_query_result is None:
         return None
-    return models.common.TokenInformation(
-        id=access_token_query_result[0],
-        value=access_token_query_result[1],
-        active=access_token_query_result[2],
-        expires=access_token_query_result[3],
-        created=access_token_query_result[4],
-        owner_id=access_token_query_result[5],
+    token_information = models.common.TokenInformation(
+        id=token_context_query_result[0],
+        value=token_context_query_result[1],
+        active=token_context_query_result[2],
+        expires=token_context_query_result[3],
+        created=token_context_query_result[4],
+        owner_id=token_context_query_result[5],
     )
+    user = None
+    if token_context_query_result[6] is not None:
+        user = models.common.UserAccount(
+            id=token_context_query_result[6],
+            first_name=token_context_query_result[7],
+            last_name=token_context_query_result[8],
+            username=token_context_query_result[9],
+            password=token_context_query_result[10],
+            active=token_context_query_result[11],
+        )
+    scope_values = [scope for scope in token_context_query_result[12] if scope is not None]
+    return token_information, user, scope_values
 
 
 def get_refresh_token_data(identifier: typing.Union[str, int]):
@@ -307,6 +818,98 @@ def get_refresh_token_data(identifier: typing.Union[str, int]):
     )
 
 
+def _build_token_data_query() -> sqlalchemy.sql.CompoundSelect:
+    """
+    Build the query selecting an access or refresh token and its scopes by the hash of the token
+
+    :return: The query expecting the ``token_hash`` parameter
+    :rtype: sqlalchemy.sql.CompoundSelect
+    """
+    token_hash = sqlalchemy.sql.bindparam("token_hash")
+    access_token = database.tables.access_token
+    access_token_scopes = database.tables.access_token_scopes
+    refresh_token = database.tables.refresh_token
+    refresh_token_scopes = database.tables.refresh_token_scopes
+    scopes = database.tables.scopes
+    access_token_query = (
+        sqlalchemy.sql.select(
+            [
+                sqlalchemy.sql.literal("access_token"),
+                access_token.c.id,
+                access_token.c.value,
+                access_token.c.active,
+                access_token.c.expires,
+                access_token.c.created,
+                access_token.c.accountID,
+                sqlalchemy.func.array_agg(scopes.c.value),
+            ]
+        )
+        .select_from(
+            access_token.outerjoin(access_token_scopes, access_token_scopes.c.tokenID == access_token.c.id).outerjoin(
+                scopes, scopes.c.id == access_token_scopes.c.scopeID
+            )
+        )
+        .where(access_token.c.value == token_hash)
+        .group_by(access_token.c.id)
+    )
+    refresh_token_query = (
+        sqlalchemy.sql.select(
+            [
+                sqlalchemy.sql.literal("refresh_token"),
+                refresh_token.c.id,
+                refresh_token.c.value,
+                refresh_token.c.active,
+                refresh_token.c.expires,
+                sqlalchemy.sql.cast(sqlalchemy.sql.null(), sqlalchemy.TIMESTAMP(timezone=True)),
+                refresh_token.c.accountID,
+                sqlalchemy.func.array_agg(scopes.c.value),
+            ]
+        )
+        .select_from(
+            refresh_token.outerjoin(
+                refresh_token_scopes, refresh_token_scopes.c.tokenID == refresh_token.c.id
+            ).outerjoin(scopes, scopes.c.id == refresh_token_scopes.c.scopeID)
+        )
+        .where(refresh_token.c.value == token_hash)
+        .group_by(refresh_token.c.id)
+    )
+    # The limit lets the database skip the refresh token lookup as soon as an access token matched
+    return sqlalchemy.sql.union_all(access_token_query, refresh_token_query).limit(1)
+
+
+__token_data_query = _build_token_data_query()
+"""The query used for introspecting and revoking tokens, which is built once to skip the construction on every call"""
+
+
+def get_token_data(
+    token: str,
+) -> typing.Optional[tuple[str, models.common.TokenInformation, list[str]]]:
+    """
+    Get the access or refresh token with the supplied value and its scopes using a single query
+
+    :param token: The clear-text token
+    :type token: str
+    :return: The type of the token ("access_token" or "refresh_token"), the token information and the scope string
+        values of the token or None if no token with this value exists
+    :rtype: typing.Optional[tuple[str, models.common.TokenInformation, list[str]]]
+    """
+    token_query_result = database.engine.execute(
+        __token_data_query, {"token_hash": hashlib.sha3_224(token.encode("utf-8")).hexdigest()}
+    ).first()
+    if token_query_result is None:
+        return None
+    token_information = models.common.TokenInformation(
+        id=token_query_result[1],
+        value=token_query_result[2],
+        active=token_query_result[3],
+        expires=token_query_result[4],
+        created=token_query_result[5],
+        owner_id=token_query_result[6],
+    )
+    scope_values = [scope for scope in token_query_result[7] if scope is not None]
+    return token_query_result[0], token_information, scope_values
+
+
 def delete_access_token(token: models.common.TokenInformation):
     delete_access_token_query = sqlalchemy.sql.delete(database.tables.access_token).where(
         database.tables.access_token.c.id == token.id,
@@ -321,15 +924,25 @@ def delete_refresh_token(token: models.common.TokenInformation):
     database.engine.execute(delete_refresh_token_query)
 
 
-def delete_all_access_tokens(user: models.common.UserAccount):
-    delete_access_token_query = sqlalchemy.sql.delete(database.tables.access_token).where(
-        database.tables.access_token.c.accountID == user.id,
-    )
-    database.engine.execute(delete_access_token_query)
+def invalidate_all_tokens(user: models.common.UserAccount):
+    """
+    Delete all access and refresh tokens of the user with a single statement
 
+    The deletion of the access tokens is executed as data-modifying CTE of the refresh token deletion. The token scope
+    mappings are removed by the cascading foreign keys
 
-def delete_all_refresh_tokens(user: models.common.UserAccount):
-    delete_refresh_token_query = sqlalchemy.sql.delete(database.tables.refresh_token).where(
-        database.tables.refresh_token.c.accountID == user.id,
+    :param user: The user whose tokens shall be deleted
+    :type user: models.common.UserAccount
+    """
+    delete_access_token_query = (
+        sqlalchemy.sql.delete(database.tables.access_token)
+        .where(database.tables.access_token.c.accountID == user.id)
+        .returning(database.tables.access_token.c.id)
+        .cte("deleted_access_tokens")
+    )
+    delete_refresh_token_query = (
+        sqlalchemy.sql.delete(database.tables.refresh_token)
+        .where(database.tables.refresh_token.c.accountID == user.id)
+        .add_cte(delete_access_token_query)
     )
     database.engine.execute(delete_refresh_token_query)
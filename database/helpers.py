@@ -1,43 +1,51 @@
 import logging
-import pathlib
+import secrets
 
-import orjson
-import passlib.pwd
+import sqlalchemy.engine
+import sqlalchemy.sql
 
-import models.requests
+import configuration
 import database
 import database.crud
+import database.tables
+import tools
 
 
-def create_initial_data(scope_file: pathlib.Path):
+def create_initial_data(connection: sqlalchemy.engine.Connection):
     """
     Create the initial data in the database
 
-    :param scope_file:
-    :type scope_file:
-    :return:
-    :rtype:
+    The scopes and the root user are stored on the supplied connection, so they are committed together with the
+    creation of the schema and nothing is left behind if one of the steps fails
+
+    :param connection: The connection of the transaction in which the initial data shall be stored
+    :type connection: sqlalchemy.engine.Connection
     """
-    # Read the scopes the service uses
-    service_scopes: list[dict] = orjson.loads(scope_file.open().read())
-    for service_scope in service_scopes:
-        # Create an scope creation object
-        scope = models.requests.ScopeCreationData(
-            name=service_scope.get("name"),
-            description=service_scope.get("description"),
-            scope_string_value=service_scope.get("scopeStringValue"),
-        )
-        database.crud.store_new_scope(scope)
+    # Store the scopes the service uses
+    database.crud.store_missing_scopes(configuration.get_required_scopes(), connection)
     # Now Create a new root user
     logging.warning("Creating new user and printing credentials to the stdout")
-    # Generate a password using passlib
-    password = passlib.pwd.genword(length=16)
-    root_user = models.requests.AccountCreationInformation(
-        first_name="Administrator",
-        last_name="Administrator",
-        username="root",
-        scopes=[s.scope_string_value for s in database.crud.get_scopes()],
-        password=password,
+    # Generate a random url-safe password with 192 bits of entropy
+    password = secrets.token_urlsafe(24)
+    accounts = database.tables.accounts
+    account_scopes = database.tables.account_scopes
+    scopes = database.tables.scopes
+    root_user_insert_query = (
+        sqlalchemy.sql.insert(accounts)
+        .values(
+            firstName="Administrator",
+            lastName="Administrator",
+            username="root",
+            password=tools.password_hasher.hash(password),
+            active=True,
+        )
+        .returning(accounts.c.id)
+    )
+    root_user_id = connection.execute(root_user_insert_query).scalar()
+    # Assign every scope to the root user without reading the scopes back first
+    root_user_scopes_query = sqlalchemy.sql.insert(account_scopes).from_select(
+        [account_scopes.c.accountID, account_scopes.c.scopeID],
+        sqlalchemy.sql.select([sqlalchemy.sql.literal(root_user_id), scopes.c.id]),
     )
-    database.crud.store_new_user(root_user)
+    connection.execute(root_user_scopes_query)
     logging.critical("==== ROOT ACCOUNT INFORMATION ====\nUsername: root\nPassword: %s", password)
@@ -1,4 +1,9 @@
+import logging
+import typing
+
 import sqlalchemy
+import sqlalchemy.engine
+import sqlalchemy.schema
 
 import database
 
@@ -43,6 +48,7 @@ access_token = sqlalchemy.Table(
     sqlalchemy.Column("expires", sqlalchemy.TIMESTAMP(timezone=True)),
     sqlalchemy.Column("created", sqlalchemy.TIMESTAMP(timezone=True)),
     sqlalchemy.Column("accountID", None, sqlalchemy.ForeignKey("accounts.id", **__fk_options)),
+    sqlalchemy.UniqueConstraint("value", name="accessTokens_value_key"),
 )
 
 refresh_token = sqlalchemy.Table(
@@ -53,6 +59,7 @@ refresh_token = sqlalchemy.Table(
     sqlalchemy.Column("active", sqlalchemy.Boolean, default=True),
     sqlalchemy.Column("expires", sqlalchemy.TIMESTAMP(timezone=True)),
     sqlalchemy.Column("accountID", None, sqlalchemy.ForeignKey("accounts.id", **__fk_options)),
+    sqlalchemy.UniqueConstraint("value", name="refreshTokens_value_key"),
 )
 
 role_scopes = sqlalchemy.Table(
@@ -61,6 +68,8 @@ role_scopes = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
     sqlalchemy.Column("roleID", None, sqlalchemy.ForeignKey("roles.id", **__fk_options)),
     sqlalchemy.Column("scopeID", None, sqlalchemy.ForeignKey("scopes.id", **__fk_options)),
+    sqlalchemy.UniqueConstraint("roleID", "scopeID", name="roleScopes_roleID_scopeID_key"),
+    sqlalchemy.Index("roleScopes_scopeID_idx", "scopeID"),
 )
 
 access_token_scopes = sqlalchemy.Table(
@@ -73,6 +82,8 @@ access_token_scopes = sqlalchemy.Table(
     sqlalchemy.Column(
         "scopeID", sqlalchemy.Integer, sqlalchemy.ForeignKey("scopes.id", **__fk_options)
     ),
+    sqlalchemy.UniqueConstraint("tokenID", "scopeID", name="accessTokenScopes_tokenID_scopeID_key"),
+    sqlalchemy.Index("accessTokenScopes_scopeID_idx", "scopeID"),
 )
 
 refresh_token_scopes = sqlalchemy.Table(
@@ -80,11 +91,13 @@ refresh_token_scopes = sqlalchemy.Table(
     __metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
     sqlalchemy.Column(
-        "tokenID", sqlalchemy.Integer, sqlalchemy.ForeignKey("accessTokens.id", **__fk_options)
+        "tokenID", sqlalchemy.Integer, sqlalchemy.ForeignKey("refreshTokens.id", **__fk_options)
     ),
     sqlalchemy.Column(
         "scopeID", sqlalchemy.Integer, sqlalchemy.ForeignKey("scopes.id", **__fk_options)
     ),
+    sqlalchemy.UniqueConstraint("tokenID", "scopeID", name="refreshTokenScopes_tokenID_scopeID_key"),
+    sqlalchemy.Index("refreshTokenScopes_scopeID_idx", "scopeID"),
 )
 
 account_scopes = sqlalchemy.Table(
@@ -97,6 +110,8 @@ account_scopes = sqlalchemy.Table(
     sqlalchemy.Column(
         "scopeID", sqlalchemy.Integer, sqlalchemy.ForeignKey("scopes.id", **__fk_options)
     ),
+    sqlalchemy.UniqueConstraint("accountID", "scopeID", name="accountScopes_accountID_scopeID_key"),
+    sqlalchemy.Index("accountScopes_scopeID_idx", "scopeID"),
 )
 
 account_roles = sqlalchemy.Table(
@@ -109,11 +124,199 @@ account_roles = sqlalchemy.Table(
     sqlalchemy.Column(
         "scopeID", sqlalchemy.Integer, sqlalchemy.ForeignKey("roles.id", **__fk_options)
     ),
+    sqlalchemy.UniqueConstraint("accountID", "scopeID", name="accountRoles_accountID_scopeID_key"),
+    sqlalchemy.Index("accountRoles_scopeID_idx", "scopeID"),
+)
+
+__mapping_tables = frozenset(
+    [role_scopes.name, access_token_scopes.name, refresh_token_scopes.name, account_scopes.name, account_roles.name]
 )
+"""The tables only mapping two entries onto each other. Repeated rows in these tables do not carry any information"""
 
 
-def initialize() -> None:
+__initialized = False
+"""Indicator if the tables have been initialized in this process or the process it has been forked from"""
+
+
+def _redirect_refresh_token_scope_reference(connection: sqlalchemy.engine.Connection) -> None:
+    """
+    Point the token reference of refresh token scopes created by an earlier version of the service to the refresh tokens
+
+    The earlier versions let ``refreshTokenScopes.tokenID`` reference the access tokens. Therefore, deleting an access
+    token also deleted the scopes of the refresh token with the same id. The misdirected foreign keys are read with a
+    single query and replaced by the foreign key declared on the table. Scope rows of refresh tokens which do not exist
+    anymore would violate the new foreign key and are removed beforehand
+
+    :param connection: The connection used for reading and altering the foreign keys
+    :type connection: sqlalchemy.engine.Connection
+    """
+    misdirected_reference_query = sqlalchemy.text(
+        "SELECT con.conname FROM pg_constraint AS con "
+        "JOIN pg_class AS rel ON rel.oid = con.conrelid "
+        "JOIN pg_namespace AS nsp ON nsp.oid = rel.relnamespace "
+        "JOIN pg_class AS ref ON ref.oid = con.confrelid "
+        "WHERE con.contype = 'f' AND nsp.nspname = :schema AND rel.relname = :table AND ref.relname = :referenced_table"
+    )
+    misdirected_references = (
+        connection.execute(
+            misdirected_reference_query,
+            {"schema": __metadata.schema, "table": refresh_token_scopes.name, "referenced_table": access_token.name},
+        )
+        .scalars()
+        .all()
+    )
+    if len(misdirected_references) == 0:
+        return
+    preparer = connection.dialect.identifier_preparer
+    table_name = preparer.format_table(refresh_token_scopes)
+    for constraint_name in misdirected_references:
+        connection.execute(
+            sqlalchemy.text(f"ALTER TABLE {table_name} DROP CONSTRAINT {preparer.quote(constraint_name)}")
+        )
+    orphan_deletion_query = sqlalchemy.sql.delete(refresh_token_scopes).where(
+        ~sqlalchemy.sql.exists().where(refresh_token.c.id == refresh_token_scopes.c.tokenID)
+    )
+    orphan_count = connection.execute(orphan_deletion_query).rowcount
+    if orphan_count > 0:
+        logging.warning(
+            "Removed %d scope assignments of refresh tokens which do not exist anymore from '%s'",
+            orphan_count,
+            refresh_token_scopes.name,
+        )
+    for constraint in refresh_token_scopes.foreign_key_constraints:
+        if constraint.referred_table is refresh_token:
+            connection.execute(sqlalchemy.schema.AddConstraint(constraint))
+    logging.info("Redirected the token reference of '%s' to '%s'", refresh_token_scopes.name, refresh_token.name)
+
+
+def _remove_repeated_rows(
+    connection: sqlalchemy.engine.Connection, table: sqlalchemy.Table, column_names: list[str], constraint_name: str
+) -> None:
+    """
+    Remove the rows repeating the values of a unique constraint from a mapping table or check other tables for them
+
+    :param connection: The connection used for removing the rows
+    :type connection: sqlalchemy.engine.Connection
+    :param table: The table which will receive the unique constraint
+    :type table: sqlalchemy.Table
+    :param column_names: The quoted names of the columns in the unique constraint
+    :type column_names: list[str]
+    :param constraint_name: The name of the unique constraint
+    :type constraint_name: str
+    :raises RuntimeError: The table is no mapping table and contains repeated values
+    """
+    table_name = connection.dialect.identifier_preparer.format_table(table)
+    duplicate_condition = " AND ".join(f"duplicate.{name} = original.{name}" for name in column_names)
+    if table.name in __mapping_tables:
+        duplicate_count = connection.execute(
+            sqlalchemy.text(
+                f"DELETE FROM {table_name} AS duplicate USING {table_name} AS original "
+                f"WHERE duplicate.id > original.id AND {duplicate_condition}"
+            )
+        ).rowcount
+        if duplicate_count > 0:
+            logging.warning("Removed %d repeated rows from '%s'", duplicate_count, table.name)
+        return
+    duplicate = connection.execute(
+        sqlalchemy.text(
+            f"SELECT duplicate.id FROM {table_name} AS duplicate JOIN {table_name} AS original "
+            f"ON duplicate.id > original.id AND {duplicate_condition} LIMIT 1"
+        )
+    ).first()
+    if duplicate is not None:
+        raise RuntimeError(
+            f"The table '{table.name}' contains repeated values in ({', '.join(column_names)}). Remove "
+            f"them before starting the service, so the constraint '{constraint_name}' can be added"
+        )
+
+
+def _add_missing_indexes(connection: sqlalchemy.engine.Connection, tables: list[sqlalchemy.Table]) -> None:
+    """
+    Add the named unique constraints and indexes to tables created by an earlier version of the service
+
+    The present constraints and indexes are read with a single query each. A unique constraint is added by building its
+    index first and attaching the index to the table as the constraint, so existing and newly created schemas end up
+    with the same constraints. Since the earlier versions did not prevent repeated rows, these are removed from the
+    mapping tables before a missing unique index is created, keeping the row with the lowest id. Repeated values in
+    other tables are not removed automatically, since they may indicate a larger problem
+
+    :param connection: The connection used for reading and creating the indexes
+    :type connection: sqlalchemy.engine.Connection
+    :param tables: The tables which already existed in the database
+    :type tables: list[sqlalchemy.Table]
+    :raises RuntimeError: A table which is no mapping table contains repeated values in a unique constraint
+    """
+    present_constraint_query = sqlalchemy.text(
+        "SELECT con.conname FROM pg_constraint AS con JOIN pg_namespace AS nsp ON nsp.oid = con.connamespace "
+        "WHERE nsp.nspname = :schema"
+    )
+    present_constraints = set(
+        connection.execute(present_constraint_query, {"schema": __metadata.schema}).scalars().all()
+    )
+    present_index_query = sqlalchemy.text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema")
+    present_indexes = set(connection.execute(present_index_query, {"schema": __metadata.schema}).scalars().all())
+    preparer = connection.dialect.identifier_preparer
+    for table in tables:
+        table_name = preparer.format_table(table)
+        for constraint in table.constraints:
+            # Only the named constraints have been added after the first version. The others exist on every table
+            if not isinstance(constraint, sqlalchemy.UniqueConstraint) or not isinstance(constraint.name, str):
+                continue
+            if constraint.name in present_constraints:
+                continue
+            constraint_name = preparer.quote(constraint.name)
+            column_names = [preparer.quote(column.name) for column in constraint.columns]
+            # The unique index may already exist without the constraint if it was built by an earlier version
+            if constraint.name not in present_indexes:
+                _remove_repeated_rows(connection, table, column_names, constraint.name)
+                connection.execute(
+                    sqlalchemy.text(
+                        f"CREATE UNIQUE INDEX {constraint_name} ON {table_name} ({', '.join(column_names)})"
+                    )
+                )
+            connection.execute(
+                sqlalchemy.text(
+                    f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} UNIQUE USING INDEX {constraint_name}"
+                )
+            )
+        for index in table.indexes:
+            if index.name in present_indexes:
+                continue
+            column_names = [preparer.quote(column.name) for column in index.columns]
+            connection.execute(
+                sqlalchemy.text(
+                    f"CREATE INDEX IF NOT EXISTS {preparer.quote(index.name)} "
+                    f"ON {table_name} ({', '.join(column_names)})"
+                )
+            )
+
+
+def initialize(connection: typing.Optional[sqlalchemy.engine.Connection] = None) -> None:
     """
     Initialize the tables used by the service
+
+    The check for existing tables is only executed once per process. Since the gunicorn master initializes the tables
+    before forking, the workers inherit the indicator and skip the check. The existing tables are read with a single
+    query instead of letting ``create_all`` probe every table on its own. Tables created by an earlier version of the
+    service receive the corrected foreign keys and the indexes added since then
+
+    :param connection: The connection on which the tables shall be created. If it is omitted, the engine is used
+    :type connection: typing.Optional[sqlalchemy.engine.Connection]
     """
-    __metadata.create_all(bind=database.engine)
+    global __initialized
+    if __initialized:
+        return
+    if connection is None:
+        with database.engine.begin() as connection:
+            initialize(connection)
+        return
+    existing_table_names = set(sqlalchemy.inspect(connection).get_table_names(schema=__metadata.schema))
+    existing_tables = [table for table in __metadata.sorted_tables if table.name in existing_table_names]
+    missing_tables = [table for table in __metadata.sorted_tables if table.name not in existing_table_names]
+    if len(missing_tables) > 0:
+        __metadata.create_all(bind=connection, tables=missing_tables, checkfirst=False)
+    if refresh_token_scopes.name in existing_table_names:
+        _redirect_refresh_token_scope_reference(connection)
+    if len(existing_tables) > 0:
+        _add_missing_indexes(connection, existing_tables)
+    __initialized = True
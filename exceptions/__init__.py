@@ -7,6 +7,10 @@ from http import HTTPStatus
 class APIException(Exception):
     """
     An error occurred during authenticating a user which led to a non 2XX response
+
+    The errors raised while authenticating requests and issuing tokens do not depend on the request. These are created
+    once on module level and raised using `with_traceback(None)`, preventing the traceback of earlier raises from being
+    kept on the shared instance. The errors of the user and scope management are rare and are created when raised
     """
 
     def __init__(
@@ -1,8 +1,7 @@
 import datetime
+import secrets
 import typing
-import uuid
 
-import passlib.hash
 import pydantic
 
 import models
@@ -31,7 +30,7 @@ class UserAccount(models.BaseModel):
 
 class TokenSet(models.BaseModel):
 
-    access_token: uuid.UUID = pydantic.Field(default_factory=uuid.uuid4)
+    access_token: str = pydantic.Field(default_factory=lambda: secrets.token_urlsafe(32))
     """The access token used in the Bearer header"""
 
     access_token_type: str = pydantic.Field(default="bearer", alias="token_type")
@@ -59,8 +58,7 @@ class TokenSet(models.BaseModel):
     def generate_refresh_token(cls, v, values):
         if v is not None:
             return v
-        access_token = str(uuid.uuid4())
-        return passlib.hash.hex_sha512.hash(access_token)
+        return secrets.token_urlsafe(32)
 
 
 class Scope(models.BaseModel):
@@ -42,3 +42,23 @@ class UserAccount(BaseModel):
     """The username of the account"""
 
     scopes: list[models.common.Scope] = pydantic.Field(default=..., title="User Scopes")
+
+    @classmethod
+    def from_account(cls, account: models.common.UserAccount, scopes: list[models.common.Scope]) -> "UserAccount":
+        """
+        Build the response from an already validated account without validating the fields again
+
+        :param account: The account of the user
+        :type account: models.common.UserAccount
+        :param scopes: The scopes of the account
+        :type scopes: list[models.common.Scope]
+        :return: The user account without the password
+        :rtype: UserAccount
+        """
+        return cls.construct(
+            id=account.id,
+            first_name=account.first_name,
+            last_name=account.last_name,
+            username=account.username,
+            scopes=scopes,
+        )
@@ -1,12 +1,22 @@
 import asyncio
+import functools
+import logging
+import pathlib
 import time
 
+import orjson
+import passlib.hash
 import requests
 
 import configuration
 import enums
 import models.common
 
+password_hasher = passlib.hash.argon2.using(
+    type="ID", digest_size=32, salt_size=16, **configuration.get_argon2_configuration().dict()
+)
+"""The Argon2id hasher used for all passwords, configured once at import"""
+
 
 async def is_host_available(host: str, port: int, timeout: int = 10) -> bool:
     """Check if the specified host is reachable on the specified port
@@ -31,27 +41,52 @@ async def is_host_available(host: str, port: int, timeout: int = 10) -> bool:
     return False
 
 
-def query_kong(path: str, method: enums.HTTPMethod, data: dict | None = None) -> requests.Response:
-    _kong = configuration.KongGatewayInformation()
+_kong_session = requests.Session()
+"""HTTP session reusing the connections to the admin api of the gateway"""
+
+
+def reset_kong_session() -> None:
+    """
+    Replace the session used for the admin api of the gateway with a new one
+
+    The gunicorn master registers the service using the session before forking the workers. Without replacing it, the
+    workers would inherit and share the pooled connections of the master
+    """
+    global _kong_session
+    _kong_session.close()
+    _kong_session = requests.Session()
+
+
+def query_kong(
+    path: str, method: enums.HTTPMethod, data: dict | None = None, timeout: float | None = None
+) -> requests.Response:
+    _kong = configuration.get_kong_gateway_information()
+    _url = f"http://{_kong.hostname}:{_kong.admin_port}{path}"
     match method:
         case enums.HTTPMethod.GET:
-            return requests.get(f"http://{_kong.hostname}:{_kong.admin_port}{path}")
+            return _kong_session.get(_url, timeout=timeout)
         case enums.HTTPMethod.POST:
-            return requests.post(f"http://{_kong.hostname}:{_kong.admin_port}{path}", data=data)
+            return _kong_session.post(_url, data=data, timeout=timeout)
         case enums.HTTPMethod.PUT:
-            return requests.put(f"http://{_kong.hostname}:{_kong.admin_port}{path}", data=data)
+            return _kong_session.put(_url, data=data, timeout=timeout)
         case enums.HTTPMethod.PATCH:
-            return requests.patch(f"http://{_kong.hostname}:{_kong.admin_port}{path}", data=data)
+            return _kong_session.patch(_url, data=data, timeout=timeout)
         case enums.HTTPMethod.DELETE:
-            return requests.delete(f"http://{_kong.hostname}:{_kong.admin_port}{path}", data=data)
+            return _kong_session.delete(_url, data=data, timeout=timeout)
         case _:
             raise Exception(
                 "The function only supports the following HTTP request types: GET, POST, PUT, PATCH, DELETE"
             )
 
 
+@functools.lru_cache(maxsize=1)
+def _gateway_credential_id() -> str:
+    """Read the id of the oauth2 credentials of this service which is written once during the startup"""
+    return pathlib.Path("/.credential_id").read_text()
+
+
 def store_token_in_gateway(token_set: models.common.TokenSet, username: str):
-    credential_id = open("/.credential_id", "rt").read()
+    credential_id = _gateway_credential_id()
     request_data = {
         "credential.id": credential_id,
         "token_type": token_set.access_token_type,
@@ -62,9 +97,14 @@ def store_token_in_gateway(token_set: models.common.TokenSet, username: str):
         "authenticated_userid": username,
     }
     response = query_kong("/oauth2_tokens", method=enums.HTTPMethod.POST, data=request_data)
+    response.raise_for_status()
 
 
 def revoke_token_in_gateway(access_token: str):
     gateway_token_request = query_kong("/oauth2_tokens", method=enums.HTTPMethod.GET)
-    token_id = [token["id"] for token in gateway_token_request.json() if token["access_token"] == access_token][0]
+    gateway_tokens = orjson.loads(gateway_token_request.content)["data"]
+    token_id = next((token["id"] for token in gateway_tokens if token["access_token"] == access_token), None)
+    if token_id is None:
+        logging.info("The revoked access token is not stored in the api gateway. Skipping its revocation there")
+        return
     gateway_token_revokation = query_kong(f"/oauth2_tokens/{token_id}", method=enums.HTTPMethod.DELETE)